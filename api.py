@@ -0,0 +1,267 @@
+"""Read-only JSON API over the data aggregated by app.py.
+
+    GET /api/countries
+    GET /api/top?data=confirmed&n=7&date=3/21/20
+    GET /api/series?data=deaths&country=France
+    GET /api/map?data=mortality&date=3/21/20
+
+data is one of confirmed, deaths or mortality, date defaults to the last
+one. Responses are cached in memory per version of the data, gzipped when
+the client accepts it, and carry an ETag changing with the version and
+the encoding. 503 while the data can't be loaded.
+
+Runs beside the app on COVID_API_PORT when it is set, or on its own:
+
+    python api.py --port 8000
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import app
+from cache import cached
+from cube import COUNTRY_COL, PROVINCE_COL, get_date_columns, get_series
+from ingest import CONFIRMED_SOURCE, DEATHS_SOURCE
+from monitoring import span
+
+logger = logging.getLogger("api")
+
+# Port of the API next to the app, 0 to disable it
+API_PORT = int(os.environ.get("COVID_API_PORT", "0"))
+MAX_TOP_N = 50
+# Query parameters of the routes, the others are ignored and don't make new cache entries
+PARAMS = {"data", "n", "date", "country"}
+# Smaller bodies aren't worth compressing
+MIN_GZIP_BYTES = 1000
+
+_server_lock = threading.Lock()
+_server_started = False
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def get_datasets():
+    # Same data as app.main, already in memory when the API runs beside the
+    # app. Once loaded, this is a cache lookup or a stat of the snapshots.
+    return [app.get_dataset(url) for url in (CONFIRMED_SOURCE, DEATHS_SOURCE)]
+
+
+def get_etag(confirmed, deaths, encoding=None):
+    # Strong ETag, so each representation gets its own: the gzipped body
+    # has a different tag than the identity one
+    versions = f"{confirmed.version}:{deaths.version}"
+    tag = hashlib.sha1(versions.encode("utf-8")).hexdigest()[:16]
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def matches(if_none_match, etag):
+    return if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def get_data(name, confirmed, deaths, frame=False):
+    # frame: with the per-location frame, only /api/map needs it
+    data_choices = {"confirmed": "Infections", "deaths": "Deaths", "mortality": "Mortality Rate"}
+    if name not in data_choices:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"data must be one of {', '.join(data_choices)}")
+    if frame:
+        return app.get_map_data(data_choices[name], confirmed, deaths)
+    return app.get_data(data_choices[name], confirmed, deaths)
+
+
+def get_date_index(data, params):
+    dates = data.cube.dates
+    if "date" not in params:
+        return len(dates) - 1
+    try:
+        return dates.index(params["date"])
+    except ValueError:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"No data on {params['date']}")
+
+
+def to_json_values(values):
+    # NaN isn't valid JSON: mortality rates without any case and missing
+    # coordinates become null
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return [None if np.isnan(v) else v for v in values.tolist()]
+    return values.tolist()
+
+
+def get_countries(confirmed, deaths, params):
+    return app.get_countries(confirmed)
+
+
+def get_top(confirmed, deaths, params):
+    data = get_data(params.get("data", "confirmed"), confirmed, deaths)
+    try:
+        n = int(params.get("n", app.DEFAULT_TOP_N))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "n must be an integer")
+    n = min(max(n, 1), MAX_TOP_N)
+    return app.get_top_countries(data, n=n, date_index=get_date_index(data, params))
+
+
+def get_country_series(confirmed, deaths, params):
+    data = get_data(params.get("data", "confirmed"), confirmed, deaths)
+    country = params.get("country")
+    if country not in data.cube.index:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown country: {country}")
+    return {
+        "country": country,
+        "dates": data.cube.dates,
+        "values": to_json_values(get_series(data.cube, country)),
+    }
+
+
+def get_map_points(confirmed, deaths, params):
+    data = get_data(params.get("data", "confirmed"), confirmed, deaths, frame=True)
+    date_index = get_date_index(data, params)
+    df = data.frame
+    return {
+        "date": data.cube.dates[date_index],
+        "country": df[COUNTRY_COL].astype(str).tolist(),
+        "province": df[PROVINCE_COL].astype(object).fillna("").tolist(),
+        # Some locations have no coordinates
+        "lat": to_json_values(np.round(df["Lat"].to_numpy(dtype=np.float64), 4)),
+        "long": to_json_values(np.round(df["Long"].to_numpy(dtype=np.float64), 4)),
+        "values": to_json_values(df[get_date_columns(df)[date_index]].to_numpy()),
+    }
+
+
+ROUTES = {
+    "/api/countries": get_countries,
+    "/api/top": get_top,
+    "/api/series": get_country_series,
+    "/api/map": get_map_points,
+}
+
+
+@cached
+def get_response(confirmed, deaths, path, params):
+    # Body of a successful response, and its gzipped version, per version of
+    # the data: a later request only looks them up
+    if path not in ROUTES:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown path: {path}")
+    # NaN must have been turned into null by to_json_values, strict JSON
+    # parsers reject the whole body otherwise
+    body = json.dumps(ROUTES[path](confirmed, deaths, dict(params)), allow_nan=False).encode("utf-8")
+    compressed = gzip.compress(body, mtime=0) if len(body) >= MIN_GZIP_BYTES else None
+    return body, compressed
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive: clients polling the API reuse their connection. Headers and
+    # body are two writes, without TCP_NODELAY the body waits for a delayed ACK.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        with span("api"):
+            url = urlsplit(self.path)
+            params = tuple(sorted((k, v) for k, v in parse_qsl(url.query) if k in PARAMS))
+            try:
+                confirmed, deaths = get_datasets()
+            except Exception:
+                # A cold start without network for instance: the client gets
+                # an answer rather than a reset connection
+                logger.exception("API: data unavailable")
+                self.send_body(
+                    HTTPStatus.SERVICE_UNAVAILABLE,
+                    json.dumps({"error": "Data unavailable, try again later"}).encode("utf-8")
+                )
+                return
+
+            # Unknown paths and invalid parameters are errors whatever the
+            # client has cached, the response is looked up before the ETag
+            try:
+                body, compressed = get_response(confirmed, deaths, url.path, params)
+            except ApiError as e:
+                self.send_body(e.status, json.dumps({"error": str(e)}).encode("utf-8"))
+                return
+
+            encoding = None
+            if compressed is not None and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body, encoding = compressed, "gzip"
+
+            etag = get_etag(confirmed, deaths, encoding)
+            if matches(self.headers.get("If-None-Match"), etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Vary", "Accept-Encoding")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_body(HTTPStatus.OK, body, etag, encoding)
+
+    def send_body(self, status, body, etag=None, encoding=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+
+def serve(port):
+    server = ThreadingHTTPServer(("", port), ApiHandler)
+    server.daemon_threads = True
+    logger.info("JSON API on port %d", server.server_address[1])
+    return server
+
+
+def start_api_server():
+    # Once per process, in a background thread
+    global _server_started
+    with _server_lock:
+        if _server_started or not API_PORT:
+            return
+        _server_started = True
+        try:
+            server = serve(API_PORT)
+        except OSError as e:
+            logger.warning("JSON API not served on port %d: %s", API_PORT, e)
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=API_PORT or 8000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    server = serve(args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
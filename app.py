@@ -8,70 +8,218 @@ from PIL import Image
 import pandas as pd
 import numpy as np
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 import plotly.express as px
 import plotly.graph_objects as go
 
-DATA_SOURCE_URL = "https://github.com/CSSEGISandData/COVID-19/tree/master/csse_covid_19_data/csse_covid_19_time_series"
-
-CONFIRMED_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"
-DEATHS_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv"
+from artifacts import get_artifact_path, get_artifacts_dir, read_figure
+from cache import TOTAL_MAX_BYTES, cached, get_cache_stats, get_total_bytes, set_version
+from decimate import lttb
+from fetch import get_fetch_stats
+from ingest import (
+    CONFIRMED_SOURCE, DEATHS_SOURCE, INGEST_WORKER, LOAD_RECOVERED, RECOVERED_SOURCE,
+    US_CONFIRMED_SOURCE, US_DEATHS_SOURCE, Dataset, get_default_memory_usage, get_memory_usage, load_source,
+    open_snapshot
+)
+from monitoring import DEBUG, get_rss, get_spans, reset_spans, span, start_metrics_server, with_spans
+from quality import get_issues
+from cube import (
+    COUNTRY_COL, PROVINCE_COL, WORLDWIDE,
+    ROLLING_WINDOW,
+    build_metrics, build_mortality_cube, build_offsets, build_ranking, divide, get_date_columns, get_series, get_top
+)
 
-COUNTRY_COL = "Country/Region"
-PROVINCE_COL = "Province/State"
+DATA_SOURCE_URL = "https://github.com/CSSEGISandData/COVID-19/tree/master/csse_covid_19_data/csse_covid_19_time_series"
 
 # Max scale factor for bubble size
 MAX_SCALE = 10000
 
-
-@st.cache
+DATA_CHOICES = ["Infections", "Deaths", "Mortality Rate"]
+
+# Default values of the sliders, the figures they give are pre-rendered
+DEFAULT_TOP_N = 7
+DEFAULT_BUBBLE_SIZE = 7
+# Cases from which the series are aligned in "Days since Nth case"
+DEFAULT_ALIGN_THRESHOLD = 100
+
+# Bubble scale of each step of the "Bubble size" slider
+MAP_SCALES = np.geomspace(0.0001, 0.002, num=15)
+
+# Days between two frames of the animated map, raised to stay within
+# MAX_MAP_FRAMES (see get_map_timelines)
+MAP_FRAME_STEPS = {"Daily": 1, "Weekly": 7, "Monthly": 30}
+
+DAILY_PLOT = f"Daily new cases ({ROLLING_WINDOW}-day average)"
+
+# Rendering of the evolution plot: "Fast" downsamples each series to
+# FAST_POINTS points and draws them with WebGL. "Auto" switches to it above
+# FAST_THRESHOLD points in total.
+RENDER_CHOICES = ["Auto", "Full", "Fast"]
+# Where the scale and the countries of the evolution plot are chosen: with
+# widgets, each change reruns the script and sends a new figure, or with
+# buttons in the plot, the figure then only changes with the candidates
+CONTROL_CHOICES = ["Widgets", "In the plot"]
+TOGGLE_TOP_N = [3, 5, 10]
+FAST_POINTS = 1000
+FAST_THRESHOLD = 20000
+# Budget of the animated map: above MAX_MAP_FRAMES frames, dates are
+# subsampled further. At the size of the global time series, its figure
+# must stay under MAX_MAP_BYTES of JSON built in MAX_MAP_SECONDS, which
+# benchmarks/bench.py checks.
+MAX_MAP_FRAMES = 120
+MAX_MAP_BYTES = 1000000
+MAX_MAP_SECONDS = 0.5
+# Decimals kept in the map coordinates, about 1 km
+MAP_PRECISION = 2
+
+
+# Memory-mapped, so the size of a dataset isn't a reason to evict it: no
+# byte limit, and out of the budget shared by the other caches
+@cached(max_bytes=None)
 def load_data(data_url):
-    df = pd.read_csv(data_url)
-    return df
+    # Memory-mapped from the binary snapshot, which is updated incrementally
+    # when the source changes
+    return load_source(data_url)
+
+
+def get_dataset(data_url):
+    # With the ingest worker, reruns pick up the snapshot it last published.
+    # The app only loads the source itself until that first snapshot exists.
+    # A new version expires what the caches hold for the previous one.
+    dataset = None
+    if INGEST_WORKER:
+        dataset = open_snapshot(data_url)
+    if dataset is None:
+        dataset = load_data(data_url)
+    set_version(data_url, dataset.version)
+    return dataset
+
+
+def load_datasets(*data_urls):
+    # Fetched and parsed concurrently, so a cold start waits for the slowest
+    # source rather than for all of them in a row. Their stages are recorded
+    # in the spans of the rerun.
+    with ThreadPoolExecutor(max_workers=len(data_urls)) as executor:
+        return list(executor.map(with_spans(get_dataset), data_urls))
+
+
+def get_data(data_choice, confirmed, deaths, recovered=None):
+    if data_choice == "Deaths":
+        return deaths
+    if data_choice == "Recovered":
+        return recovered
+    if data_choice == "Mortality Rate":
+        return get_mortality_cube(confirmed, deaths)
+    return confirmed
+
+
+def get_map_data(data_choice, confirmed, deaths, recovered=None):
+    # Same as get_data, with the per-location frame of the mortality rates,
+    # only built for the map and Show Data
+    if data_choice == "Mortality Rate":
+        return get_df_mortality_rate(confirmed, deaths)
+    return get_data(data_choice, confirmed, deaths, recovered)
+
+
+def get_prerendered(datasets, kind, *key):
+    # Figure written by prerender.py for these versions of the data, or None
+    path = get_artifact_path(get_artifacts_dir(datasets), kind, *key)
+    if not os.path.exists(path):
+        return None
+    return read_prerendered(path)
+
+
+@cached(max_entries=64)
+def read_prerendered(path):
+    return read_figure(path)
+
+
+@cached
+def get_countries(data):
+    # Countries of the cube are already sorted, after the Worldwide row
+    return data.cube.countries[1:]
+
 
+@cached
+def get_ranking(data):
+    return build_ranking(data.cube)
 
-@st.cache
-def get_countries(df):
-    return sorted(df[COUNTRY_COL].unique().tolist())
 
+def get_top_countries(data, n=6, date_index=-1):
+    # Slice of the ranking index, for any n and any date
+    return get_top(data.cube, get_ranking(data), n, date_index)
 
-@st.cache
-def get_top_countries(df2, n=6):
 
-    df = df2.copy(deep=True)
-    df = df.drop(columns=[PROVINCE_COL, "Lat", "Long"])
-    # st.write(df.groupby(COUNTRY_COL).agg("sum"))
-    top = df.groupby(COUNTRY_COL).agg("sum").sort_values(by=df.columns.tolist()[-1], ascending=False)
-    # st.write(top)
-    top_countries = top.head(n).index.tolist()
-    # st.write(top_countries)
+def get_df_plot(cube, country):
+    return pd.DataFrame({"Cases": get_series(cube, country)}, index=cube.dates)
 
-    return top_countries
 
+@cached
+def get_metrics(data):
+    # Daily increments, rolling means, growth and doubling times of every
+    # country, computed once per dataset version for both views
+    return build_metrics(data.cube)
 
-@st.cache
-def get_df_plot(df, country):
-    df_country = df[df[COUNTRY_COL] == country]
-    # st.write(df_country)
 
-    df_plot = df_country.copy(deep=True)
-    df_plot = df_plot.drop(columns=[PROVINCE_COL, COUNTRY_COL, "Lat", "Long"])
-    df_plot = df_plot.sum(axis=0)
-    df_plot = pd.DataFrame(df_plot)
-    # st.write(df_plot.columns.tolist())
-    df_plot.columns = ["Cases"]
+def get_df_daily(data, country):
+    metrics = get_metrics(data)
+    row = data.cube.index[country]
+    return pd.DataFrame({
+        "New": metrics.daily[row],
+        "Cases": metrics.rolling[row],
+        "Corrections": metrics.corrections[row],
+        "Doubling": metrics.doubling[row],
+    }, index=data.cube.dates)
 
-    return df_plot
 
+def get_plot_series(data, country, plot_choice):
+    # Plotted values of country, a view on a row of the cube or of the metrics
+    if plot_choice == DAILY_PLOT:
+        return get_metrics(data).rolling[data.cube.index[country]]
+    return get_series(data.cube, country)
 
-@st.cache
-def get_fig(dfs_plot, log_scale_choice):
+
+@cached
+def get_offsets(data, threshold):
+    # Index of the first date with at least threshold cases, per row of the cube
+    return build_offsets(data.cube, threshold)
+
+
+def use_fast_render(n_points, render_choice):
+    if render_choice == "Auto":
+        return n_points > FAST_THRESHOLD
+    return render_choice == "Fast"
+
+
+def build_fig(data, countries, log_scale_choice, plot_choice="Total", render_choice="Auto", align_threshold=None):
+    # With align_threshold, each series starts on the day its country
+    # reached that many cases: a slice of its row, not a copy. Countries
+    # that haven't reached it yet are left out.
     fig = go.Figure()
 
-    for country, df in dfs_plot.items():
-        fig.add_trace(go.Scatter(
-            x=df.index, 
-            y=df["Cases"], 
+    fast = use_fast_render(len(countries) * len(data.cube.dates), render_choice)
+    scatter = go.Scattergl if fast else go.Scatter
+
+    dates = pd.Index(data.cube.dates)
+    if align_threshold is not None:
+        offsets = get_offsets(data, align_threshold)
+        days = np.arange(len(dates))
+
+    for country in countries:
+        x, y = dates, get_plot_series(data, country, plot_choice)
+        if align_threshold is not None:
+            offset = offsets[data.cube.index[country]]
+            if offset < 0:
+                continue
+            y = y[offset:]
+            x = days[:len(y)]
+        if fast:
+            kept = lttb(y, FAST_POINTS)
+            x, y = x[kept], y[kept]
+        fig.add_trace(scatter(
+            x=x, 
+            y=y, 
             name=f"{country}", 
             # Unsuccessful attempt to add non-hovering text
             # https://plotly.com/python/text-and-annotations/#adding-text-to-data-in-line-and-scatter-plots
@@ -93,54 +241,126 @@ def get_fig(dfs_plot, log_scale_choice):
         width=1000,
         height=800)
 
+    if plot_choice == DAILY_PLOT:
+        fig.update_layout(
+            yaxis_title="Number of new cases per day",
+            title_text=f"{DAILY_PLOT} of Covid-19")
+
+    if align_threshold is not None:
+        fig.update_layout(xaxis_title=f"Days since {align_threshold:,} cases")
+
     if log_scale_choice == "Logarithmic":
         fig.update_yaxes(type="log")
 
     return fig
 
 
-@st.cache
-def get_map_plot(df2, scale=0.005):
-    # https://plotly.com/python/scatter-plots-on-maps/
-    # https://plotly.com/python/bubble-maps/
-    df = df2.copy(deep=True)
+@cached(max_entries=32)
+def get_fig(data, countries, log_scale_choice, plot_choice="Total", render_choice="Auto", align_threshold=None):
+    return build_fig(data, countries, log_scale_choice, plot_choice, render_choice, align_threshold)
 
-    # df["Description"] = df[COUNTRY_COL].str.cat(df[df.columns.tolist()[-1]].astype(str), sep="_")
-    # fig = px.scatter_geo(df, locations="iso_alpha", color="continent",
-    #                  hover_name=COUNTRY_COL, size=df.columns.tolist()[-1],
-    #                  projection="natural earth")
 
-    # st.write(df)
+@cached(max_entries=16)
+def get_fig_interactive(data, candidates, plot_choice="Total", render_choice="Auto", align_threshold=None):
+    # Every candidate is sent once and the browser does the rest: buttons for
+    # the scale and for the number of countries shown, and a click on a
+    # country in the legend shows or hides it (a double click isolates it).
+    # Worldwide starts hidden, its numbers flatten the other curves.
+    fig = build_fig(data, candidates, "Standard", plot_choice, render_choice, align_threshold)
+    for trace in fig.data:
+        if trace.name == WORLDWIDE:
+            trace.visible = "legendonly"
+
+    # Counted on the traces, candidates below align_threshold have none
+    n_traces = len(fig.data)
+
+    def show(n):
+        return [True if i < n else "legendonly" for i in range(n_traces)]
+
+    fig.update_layout(updatemenus=[
+        dict(
+            type="buttons", direction="left", x=0, xanchor="left", y=1.02, yanchor="bottom",
+            buttons=[
+                dict(label="Standard", method="relayout", args=[{"yaxis.type": "linear"}]),
+                dict(label="Logarithmic", method="relayout", args=[{"yaxis.type": "log"}]),
+            ]
+        ),
+        dict(
+            type="buttons", direction="left", x=1, xanchor="right", y=1.02, yanchor="bottom",
+            buttons=[
+                dict(label=f"Top {n}", method="restyle", args=[{"visible": show(n)}])
+                for n in TOGGLE_TOP_N if n < n_traces
+            ] + [
+                dict(label="All", method="restyle", args=[{"visible": show(n_traces)}]),
+            ]
+        ),
+    ])
+    return fig
+
+
+@cached(max_entries=32)
+def get_fig_payload(data, countries, log_scale_choice, plot_choice, render_choice, align_threshold=None):
+    # Size in bytes of the figure sent to the browser, in full and as rendered
+    full = get_fig(data, countries, log_scale_choice, plot_choice, "Full", align_threshold)
+    rendered = get_fig(data, countries, log_scale_choice, plot_choice, render_choice, align_threshold)
+    return len(full.to_json()), len(rendered.to_json())
 
-    df["text"] = (
-        df[COUNTRY_COL] 
-        + "<br> " 
-        + df[PROVINCE_COL].replace(np.nan, '', regex=True) 
-        + "<br>"
-        + df[df.columns.tolist()[-1]].apply(str)
-    ).str.replace("<br> <br>", "<br>")
-    # df["text"] = df.agg(lambda x: f"{x[COUNTRY_COL]} - {x[PROVINCE_COL]} :  {str(x[df.columns.tolist()[-1]])}", axis=1)
-    # st.write(df["text"])
-    # st.write(df[COUNTRY_COL])
+
+@cached
+def get_map_locations(data):
+    # Everything about the locations that doesn't depend on the date or on the
+    # bubble size, built once per dataset version:
+    # coordinates rounded to MAP_PRECISION, hover labels and hover format
+    df = data.frame
+    province = df[PROVINCE_COL].astype(object).fillna("")
+    text = df[COUNTRY_COL].astype(str) + ("<br>" + province).where(province != "", "")
+
+    counts = df[get_date_columns(df)]
+    integer = all(pd.api.types.is_integer_dtype(t) for t in counts.dtypes)
+
+    return dict(
+        lon=np.round(df["Long"].to_numpy(dtype=np.float64), MAP_PRECISION),
+        lat=np.round(df["Lat"].to_numpy(dtype=np.float64), MAP_PRECISION),
+        text=text.to_numpy(),
+        hovertemplate="%{text}<br>%{customdata" + (":," if integer else ":.2%") + "}<extra></extra>",
+    )
+
+
+def get_map_sizes(counts, scale):
+    # Changed it to np.max to avoid errors when JHU gives a negative number.
+    # Mortality rates are NaN without any case, drawn as no bubble (their
+    # hover still shows NaN from customdata).
+    return np.round(np.maximum(np.nan_to_num(counts * scale), 0), 1)
+
+
+@cached(max_entries=32)
+def get_map_plot(data, scale=0.005, date_index=-1, scope="world"):
+    # https://plotly.com/python/scatter-plots-on-maps/
+    # https://plotly.com/python/bubble-maps/
+    # Cached per date and bubble size. A new bubble size only recomputes the
+    # sizes, the labels and coordinates come from get_map_locations.
+    locations = get_map_locations(data)
+    df = data.frame
+    counts = df[get_date_columns(df)[date_index]].to_numpy()
 
     fig = go.Figure(data=go.Scattergeo(
-        lon = df['Long'],
-        lat = df['Lat'],
-        hoverinfo="text",
-        # text = df[COUNTRY_COL],
-        text = df["text"],
-        mode = 'markers',
-        marker = dict(
-            # Changed it to np.max to avoid errors when JHU gives a negative number
-            size = np.maximum(df2[df2.columns.tolist()[-1]]*scale, 0),
-            color = "red",
-            line_width = 1,
+        lon=locations["lon"],
+        lat=locations["lat"],
+        text=locations["text"],
+        customdata=counts,
+        hovertemplate=locations["hovertemplate"],
+        mode='markers',
+        marker=dict(
+            size=get_map_sizes(counts, scale),
+            color="red",
+            line_width=1,
             sizemode="area"
         )
     ))
 
     fig.update_layout(
         title="Number of cases of Covid-19",
+        geo_scope=scope,
         
         width=1000,
         height=500)
@@ -148,27 +368,154 @@ def get_map_plot(df2, scale=0.005):
     return fig
 
 
-@st.cache
-def get_df_mortality_rate(df_confirmed, df_deaths):
+def get_frame_step(n_dates, step):
+    return max(step, math.ceil(n_dates / MAX_MAP_FRAMES))
+
+
+def get_frame_indices(n_dates, step):
+    # Every step-th date, always ending on the last one
+    step = get_frame_step(n_dates, step)
+    return np.arange(n_dates - 1, -1, -step)[::-1]
+
+
+def get_map_timelines(n_dates):
+    # Steps of the animated map by label. A choice whose step had to be
+    # raised is labelled with the real one, and offered once when several
+    # choices end up with the same step.
+    timelines = {}
+    for label, step in MAP_FRAME_STEPS.items():
+        frame_step = get_frame_step(n_dates, step)
+        if frame_step in timelines.values():
+            continue
+        if frame_step != step:
+            label = f"Every {frame_step} days"
+        timelines[label] = frame_step
+    return timelines
+
+
+@cached(max_entries=8)
+def get_map_animation(data, scale=0.005, step=1):
+    # https://plotly.com/python/animations/
+    df = data.frame
+    dates = get_date_columns(df)
+    indices = get_frame_indices(len(dates), step)
+
+    # Sizes of every frame in one pass, rounded to keep the payload small
+    counts = df[dates].to_numpy()[:, indices]
+    sizes = get_map_sizes(counts, scale)
+
+    # Hover text is built once per location, frames only carry the counts
+    locations = get_map_locations(data)
+
+    def get_trace(k):
+        return go.Scattergeo(
+            customdata=counts[:, k],
+            marker=dict(size=sizes[:, k]),
+        )
+
+    frame_names = [str(dates[j]) for j in indices]
+    frames = [go.Frame(name=name, data=[get_trace(k)]) for k, name in enumerate(frame_names)]
+
+    fig = go.Figure(
+        data=go.Scattergeo(
+            lon=locations["lon"],
+            lat=locations["lat"],
+            text=locations["text"],
+            customdata=counts[:, -1],
+            hovertemplate=locations["hovertemplate"],
+            mode="markers",
+            marker=dict(
+                size=sizes[:, -1],
+                color="red",
+                line_width=1,
+                sizemode="area"
+            )
+        ),
+        frames=frames
+    )
+
+    animation_args = dict(mode="immediate", frame=dict(duration=0, redraw=True), transition=dict(duration=0))
+    fig.update_layout(
+        title="Number of cases of Covid-19",
+        updatemenus=[dict(
+            type="buttons",
+            showactive=False,
+            x=0.05,
+            y=0,
+            buttons=[
+                dict(label="Play", method="animate", args=[
+                    None,
+                    dict(frame=dict(duration=150, redraw=True), fromcurrent=True, transition=dict(duration=0))
+                ]),
+                dict(label="Pause", method="animate", args=[[None], animation_args]),
+            ]
+        )],
+        sliders=[dict(
+            active=len(frames) - 1,
+            currentvalue=dict(prefix="Date: "),
+            steps=[
+                dict(label=name, method="animate", args=[[name], animation_args])
+                for name in frame_names
+            ]
+        )],
+
+        width=1000,
+        height=600)
+
+    return fig
+
+
+def get_location_keys(df):
+    return df[COUNTRY_COL].astype(str) + "|" + df[PROVINCE_COL].astype(object).fillna("")
+
+
+@cached
+def get_mortality_cube(confirmed, deaths):
+    # Mortality rate (deaths / confirmed cases to date) of every country and
+    # date, for the plots, the ranking and the Country view. Countries x dates,
+    # small enough to stay cached unlike the frame of get_df_mortality_rate.
+    return Dataset(
+        f"mortality:{confirmed.version}:{deaths.version}",
+        None,
+        build_mortality_cube(confirmed.cube, deaths.cube)
+    )
+
 
-    df_countries = df_confirmed.copy(deep=True).iloc[:, :4]
+@cached
+def get_df_mortality_rate(confirmed, deaths):
+    # Mortality rate of every location and date, for the map and Show Data
+    df_confirmed = confirmed.frame
+    df_deaths = deaths.frame
+    deaths_dates = set(df_deaths.columns)
+    dates = [date for date in get_date_columns(df_confirmed) if date in deaths_dates]
 
-    df_confirmed_copy = df_confirmed.copy(deep=True)
-    df_deaths_copy = df_deaths.copy(deep=True)
-    df_confirmed_reduced = df_confirmed_copy.iloc[:, 4:].sum(axis=1).replace(0, 1)
-    df_deaths_reduced = df_deaths_copy.iloc[:, 4:].sum(axis=1)
+    # Row of df_deaths for each row of df_confirmed, -1 when the location
+    # is missing from the deaths data
+    deaths_rows = pd.Series(np.arange(len(df_deaths)), index=get_location_keys(df_deaths))
+    deaths_rows = deaths_rows[~deaths_rows.index.duplicated()]
+    rows = deaths_rows.reindex(get_location_keys(df_confirmed)).fillna(-1).to_numpy(dtype=np.intp)
 
-    df_mortality_rates = df_deaths_reduced / df_confirmed_reduced
+    confirmed_counts = df_confirmed[dates].to_numpy(dtype=np.float64)
+    deaths_counts = np.full_like(confirmed_counts, np.nan)
+    found = rows >= 0
+    deaths_counts[found] = df_deaths[dates].to_numpy(dtype=np.float64)[rows[found]]
 
-    return pd.concat([df_countries, df_mortality_rates], axis=1)
+    df = pd.DataFrame(divide(deaths_counts, confirmed_counts), columns=dates, index=df_confirmed.index)
+    df = pd.concat([df_confirmed[[PROVINCE_COL, COUNTRY_COL, "Lat", "Long"]], df], axis=1)
 
+    return get_mortality_cube(confirmed, deaths)._replace(frame=df)
 
-@st.cache
-def get_fig_country(country, df_confirmed, df_deaths):
+
+def get_mortality_rate(country, confirmed, deaths):
+    return get_series(get_mortality_cube(confirmed, deaths).cube, country)[-1]
+
+
+@cached(max_entries=64)
+def get_fig_country(country, confirmed, deaths):
     fig = go.Figure()
 
-    df_confirmed_country = get_df_plot(df_confirmed, country)
-    df_deaths_country = get_df_plot(df_deaths, country)
+    df_confirmed_country = get_df_plot(confirmed.cube, country)
+    df_deaths_country = get_df_plot(deaths.cube, country)
 
     # df_confirmed_country = get_df_plot(df_confirmed, country).cumsum(axis=0)
     # df_deaths_country = get_df_plot(df_deaths, country).cumsum(axis=0)
@@ -176,7 +523,7 @@ def get_fig_country(country, df_confirmed, df_deaths):
     # st.write(df_confirmed_country)
     # st.write(df_deaths_country)
 
-    mortality_rate = df_deaths_country.iloc[-1,0] / df_confirmed_country.iloc[-1,0]
+    mortality_rate = get_mortality_rate(country, confirmed, deaths)
 
     fig.add_trace(go.Scatter(
         x=df_confirmed_country.index, 
@@ -216,6 +563,75 @@ def get_fig_country(country, df_confirmed, df_deaths):
     return (mortality_rate, fig)
 
 
+@cached(max_entries=64)
+def get_fig_country_daily(country, confirmed, deaths):
+    fig = go.Figure()
+
+    df_confirmed_country = get_df_daily(confirmed, country)
+    df_deaths_country = get_df_daily(deaths, country)
+
+    fig.add_trace(go.Bar(
+        x=df_confirmed_country.index,
+        y=df_confirmed_country["New"],
+        name="New confirmed cases",
+        marker_color="#1f77b4",
+        opacity=0.4,
+        yaxis="y1"
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_confirmed_country.index,
+        y=df_confirmed_country["Cases"],
+        name=f"Confirmed cases, {ROLLING_WINDOW}-day average",
+        line_color="#1f77b4",
+        yaxis="y1"
+    ))
+    fig.add_trace(go.Scatter(
+        x=df_deaths_country.index,
+        y=df_deaths_country["Cases"],
+        name=f"Deaths, {ROLLING_WINDOW}-day average",
+        line_color="#ff7f0e",
+        yaxis="y2"
+    ))
+
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis=dict(
+            title="Number of new confirmed cases",
+            titlefont=dict(color="#1f77b4"),
+            tickfont=dict(color="#1f77b4"),
+        ),
+        yaxis2=dict(
+            title="Number of new deaths",
+            titlefont=dict(color="#ff7f0e"),
+            tickfont=dict(color="#ff7f0e"),
+            anchor="x",
+            overlaying="y",
+            side="right",
+        ),
+        title_text=f"Daily new cases of Covid-19 in {country}",
+
+        width=1000,
+        height=600)
+
+    return (df_confirmed_country, fig)
+
+
+def write_fig(fig):
+    # Serializes the figure and sends it to the browser.
+    # Pre-rendered figures are dicts, st.write would show them as JSON.
+    with span("send figure"):
+        st.plotly_chart(fig)
+
+
+def show_debug_panel():
+    st.subheader("🐞 Debug")
+    spans = pd.DataFrame(get_spans(), columns=["stage", "seconds", "cache"])
+    st.write("Time spent in this rerun", spans)
+    st.write(f"Resident memory: {get_rss() / 1e6:.0f} MB")
+    st.write("Download cache:", get_fetch_stats())
+    st.write(f"Caches: {get_total_bytes() / 1e6:.1f} MB of {TOTAL_MAX_BYTES / 1e6:.0f} MB", pd.DataFrame(get_cache_stats()).T)
+
+
 def main():
 
     st.header("Covid-19 visualizer")
@@ -226,17 +642,22 @@ def main():
 
     viz_choice = st.sidebar.selectbox(
         "Visualization",
-        ["World view", "Country view"],
+        ["World view", "Country view", "US view"],
         index=0
     )
 
     
 
-    df_confirmed = load_data(CONFIRMED_SOURCE)
-    df_deaths = load_data(DEATHS_SOURCE)
+    # Recovered cases are only loaded, with the others, when COVID_RECOVERED is set
+    with span("load data"):
+        if LOAD_RECOVERED:
+            confirmed, deaths, recovered = load_datasets(CONFIRMED_SOURCE, DEATHS_SOURCE, RECOVERED_SOURCE)
+        else:
+            confirmed, deaths = load_datasets(CONFIRMED_SOURCE, DEATHS_SOURCE)
+            recovered = None
 
     st.info("Data Loaded")
-    df_original = df_confirmed
+    df_original = confirmed.frame
     st.write(f"[Data]({DATA_SOURCE_URL}) last updated on: {df_original.columns.tolist()[-1]}")
 
     # st.write("Data is updated daily")
@@ -246,35 +667,72 @@ def main():
 
         data_choice = st.sidebar.radio(
         "Visualize numbers of ",
-        ["Infections", "Deaths", "Mortality Rate"],
+        DATA_CHOICES + (["Recovered"] if recovered is not None else []),
         index=0
         )
-        log_scale_choice = st.sidebar.radio(
-            "Plot Y-axis Scale",
-            ["Standard", "Logarithmic"]
+        control_choice = st.sidebar.radio(
+            "Plot controls",
+            CONTROL_CHOICES
+        )
+        log_scale_choice = "Standard"
+        if control_choice == "Widgets":
+            log_scale_choice = st.sidebar.radio(
+                "Plot Y-axis Scale",
+                ["Standard", "Logarithmic"]
+            )
+        plot_choice = "Total"
+        align_threshold = None
+        if data_choice != "Mortality Rate":
+            plot_choice = st.sidebar.radio(
+                "Plot",
+                ["Total", DAILY_PLOT]
+            )
+            x_axis_choice = st.sidebar.radio(
+                "Plot X-axis",
+                ["Date", "Days since Nth case"]
+            )
+            if x_axis_choice != "Date":
+                align_threshold = int(st.sidebar.number_input(
+                    "N",
+                    min_value=1,
+                    value=DEFAULT_ALIGN_THRESHOLD,
+                    step=10
+                ))
+        render_choice = st.sidebar.radio(
+            "Plot rendering",
+            RENDER_CHOICES
         )
     
-        df_original = df_confirmed
-        if data_choice == "Deaths":
-            df_original = df_deaths
-        if data_choice == "Mortality Rate":
-            df_original = get_df_mortality_rate(df_confirmed, df_deaths)
+        data = get_data(data_choice, confirmed, deaths, recovered)
         # st.write("DF Original")
         
         # st.write(f"[Data]({DATA_SOURCE_URL}) last updated on: {df_original.columns.tolist()[-1]}")
         show_data = st.checkbox("Show Data")
         if show_data:
+            df_original = get_map_data(data_choice, confirmed, deaths, recovered).frame
             st.write(df_original.shape)
+            st.write(
+                f"{get_memory_usage(df_original) / 1e6:.2f} MB in memory, "
+                f"{get_default_memory_usage(df_original) / 1e6:.2f} MB with the default dtypes"
+            )
             st.write(df_original)
+            st.write("Download cache:", get_fetch_stats())
+
+        # Checks run when the sources were ingested, see quality.py
+        if st.checkbox("Show data quality report"):
+            for name, dataset in (("Confirmed", confirmed), ("Deaths", deaths), ("Recovered", recovered)):
+                if dataset is None:
+                    continue
+                if dataset.quality is None:
+                    st.write(f"{name}: not checked yet")
+                    continue
+                st.write(f"{name}:", get_issues(dataset.quality) or "no issue")
+                st.write(dataset.quality)
 
         # st.write(df_original.describe())
         # st.write(df_original.dtypes)
 
-        
-
-        df =  df_original.copy(deep=True)
-
-        countries = get_countries(df_original)
+        countries = [WORLDWIDE] + get_countries(data)
         # st.write(countries)
 
 
@@ -285,61 +743,90 @@ def main():
             "Select number of most-infected countries to view",
             min_value=5,
             max_value=20,
-            value=7
+            value=DEFAULT_TOP_N
         )
 
-        top_countries = get_top_countries(df, n=top_n)
-        # st.write(top_countries)
-
-        selected_countries = st.multiselect(
-            "Select the countries you want to visualize",
-            countries,
-            default=top_countries
+        dates = data.cube.dates
+        top_date = st.selectbox(
+            "Most-infected countries as of",
+            dates,
+            index=len(dates) - 1
         )
 
-        if selected_countries != []:
-
-            dfs_plot = {}
-
-            for country in selected_countries:
-                
-                df_plot = get_df_plot(df, country)
-                dfs_plot[country] = df_plot
+        top_countries = get_top_countries(data, n=top_n, date_index=dates.index(top_date))
+        # st.write(top_countries)
 
-                # st.write(f"{country}")
-                # st.write(df_plot)
-                # st.write(dfs_plot.keys())
+        selected_countries = []
+        if control_choice == "In the plot":
+            candidates = tuple(top_countries) + (WORLDWIDE,)
+            fig = get_fig_interactive(data, candidates, plot_choice, render_choice, align_threshold)
+            write_fig(fig)
+        else:
+            selected_countries = st.multiselect(
+                "Select the countries you want to visualize",
+                countries,
+                default=top_countries
+            )
+
+        if align_threshold is not None:
+            offsets = get_offsets(data, align_threshold)
+            not_reached = [
+                country for country in (selected_countries or top_countries)
+                if offsets[data.cube.index[country]] < 0
+            ]
+            if not_reached:
+                st.write(f"Not shown, below {align_threshold:,} cases: {', '.join(not_reached)}")
 
+        if selected_countries != []:
 
-            # st.write(dfs_plot.keys())
+            fig = None
+            if align_threshold is None:
+                fig = get_prerendered(
+                    (confirmed, deaths), "fig", data_choice, selected_countries, log_scale_choice, plot_choice, render_choice
+                )
+            if fig is None:
+                fig = get_fig(
+                    data, tuple(selected_countries), log_scale_choice, plot_choice, render_choice, align_threshold
+                )
 
-            fig = get_fig(dfs_plot, log_scale_choice)
+            write_fig(fig)
 
-            st.write(fig)
+            if DEBUG:
+                full_size, size = get_fig_payload(
+                    data, tuple(selected_countries), log_scale_choice, plot_choice, render_choice, align_threshold
+                )
+                st.write(f"Figure payload: {size / 1e3:.0f} kB, {full_size / 1e3:.0f} kB in full")
 
 
 
 
         st.subheader("Map of infections")
 
-        N_SIZES = 15
-        MIN_SIZE = 0.0001
-        MAX_SIZE = 0.002
-        scales = np.geomspace(MIN_SIZE, MAX_SIZE, num=N_SIZES)
-        # st.write(scales)
+        # st.write(MAP_SCALES)
 
         bubble_size_int = st.slider(
             "Bubble size",
             min_value=1,
-            max_value=N_SIZES,
-            value=7
+            max_value=len(MAP_SCALES),
+            value=DEFAULT_BUBBLE_SIZE
         )
 
-        scale = scales[bubble_size_int-1]
-        fig = get_map_plot(df, scale)
+        scale = MAP_SCALES[bubble_size_int-1]
 
+        timelines = get_map_timelines(len(data.cube.dates))
+        map_timeline = st.radio(
+            "Map timeline",
+            ["Last day"] + list(timelines)
+        )
+        if map_timeline == "Last day":
+            fig = get_prerendered((confirmed, deaths), "map", data_choice, bubble_size_int)
+            if fig is None:
+                fig = get_map_plot(get_map_data(data_choice, confirmed, deaths, recovered), scale)
+        else:
+            fig = get_map_animation(get_map_data(data_choice, confirmed, deaths, recovered), scale, timelines[map_timeline])
 
-        st.write(fig)
+
+        write_fig(fig)
 
     # st.write("DF")
     # df =  df_original.copy(deep=True)
@@ -350,14 +837,72 @@ def main():
     if viz_choice == "Country view":
         country_choice = st.selectbox(
             "Country",
-            get_top_countries(df_original, n=len(get_countries(df_original)))
+            get_top_countries(confirmed, n=len(get_countries(confirmed)))
         )
     
-        mortality_rate, fig = get_fig_country(country_choice, df_confirmed, df_deaths)
+        fig = get_prerendered((confirmed, deaths), "country", country_choice)
+        if fig is None:
+            mortality_rate, fig = get_fig_country(country_choice, confirmed, deaths)
+        else:
+            mortality_rate = get_mortality_rate(country_choice, confirmed, deaths)
 
         st.write(f"Mortality rate in {country_choice}: {100*mortality_rate:.2f} %")
 
-        st.write(fig)
+        write_fig(fig)
+
+        fig = get_prerendered((confirmed, deaths), "country_daily", country_choice)
+        if fig is None:
+            df_daily, fig = get_fig_country_daily(country_choice, confirmed, deaths)
+        else:
+            df_daily = get_df_daily(confirmed, country_choice)
+
+        doubling = df_daily["Doubling"].iloc[-1]
+        if np.isfinite(doubling):
+            st.write(f"At the current rate, confirmed cases double every {doubling:.1f} days")
+
+        corrections = df_daily["Corrections"]
+        if corrections.any():
+            st.write(
+                f"JHU revised the total number of cases downwards on {(corrections < 0).sum()} days, "
+                f"by {-corrections.sum():.0f} cases in all. These corrections are not counted as new cases."
+            )
+
+        write_fig(fig)
+
+    if viz_choice == "US view":
+        # County-level data, the cube rows are the states after the national total
+        data_choice = st.sidebar.radio(
+            "Visualize numbers of ",
+            ["Infections", "Deaths"]
+        )
+        log_scale_choice = st.sidebar.radio(
+            "Plot Y-axis Scale",
+            ["Standard", "Logarithmic"]
+        )
+
+        with span("load data"):
+            us_confirmed, us_deaths = load_datasets(US_CONFIRMED_SOURCE, US_DEATHS_SOURCE)
+        data = us_deaths if data_choice == "Deaths" else us_confirmed
+
+        st.subheader("Evolution of the total number of cases by state")
+
+        selected_states = st.multiselect(
+            "Select the states you want to visualize",
+            data.cube.countries,
+            default=get_top_countries(data, n=DEFAULT_TOP_N)
+        )
+        if selected_states != []:
+            write_fig(get_fig(data, tuple(selected_states), log_scale_choice))
+
+        st.subheader("Map of infections by county")
+
+        bubble_size_int = st.slider(
+            "Bubble size",
+            min_value=1,
+            max_value=len(MAP_SCALES),
+            value=DEFAULT_BUBBLE_SIZE
+        )
+        write_fig(get_map_plot(data, MAP_SCALES[bubble_size_int-1], scope="usa"))
 
 
 
@@ -367,5 +912,15 @@ def main():
     st.info("""\
         Data Source: [John Hopkins University](https://github.com/CSSEGISandData/COVID-19)
     """)
-  
-main()
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    start_metrics_server()
+    # Imported here: api.py imports this file as the app module
+    from api import start_api_server
+    start_api_server()
+    reset_spans()
+    with span("rerun"):
+        main()
+    if DEBUG:
+        show_debug_panel()
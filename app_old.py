@@ -11,6 +11,8 @@ import numpy as np
 
 import plotly.graph_objects as go
 
+from ingest import load_daily_reports
+
 
 DATA_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_daily_reports/"
 # date = "01-22-2020"
@@ -41,31 +43,8 @@ def get_dates():
 
 @st.cache
 def get_data(folder_url, dates):
-    dfs = []
-    columns = []
-    for date in dates:
-        # st.write(date)
-        data_url = folder_url + date + ".csv"
-        # st.write(data_url)
-        df = pd.read_csv(data_url)
-        # st.write(df)
-        # st.write(len(df.columns.tolist()))
-        dfs.append(df)
-        for col in df.columns.tolist():
-            if col not in columns:
-                columns.append(col)
-
-    # st.write(columns)
-
-
-    concat_df = pd.concat(dfs)
-    # st.write(concat_df.shape)
-
-    # st.write(concat_df)
-
-    concat_df = concat_df.drop_duplicates()
-
-    return concat_df
+    # folder_url can also be a local directory holding the daily reports
+    return load_daily_reports(folder_url, dates)
 
 
 def preprocess_countries(df2):
@@ -82,49 +61,6 @@ def fill_nan_lat_long(df2):
     return df
 
 
-# To complete after features have been developed
-def merge_new_format(df2):
-
-    df = df2.copy(deep=True)
-    old_columns = [
-        "Province/State",
-        "Country/Region",
-        "Last Update",
-        "Confirmed",
-        "Deaths",
-        "Recovered",
-        "Latitude",
-        "Longitude"
-    ]
-    new_columns = [
-        "Province_State",
-        "Country_Region",
-        "Last_Update",
-        "Confirmed",
-        "Deaths",
-        "Recovered",
-        "Lat",
-        "Long_"
-    ]
-
-    # st.write("rows with nan")
-    # st.write(df.loc[df[old_columns[i]].isnull(), :].shape)
-    # st.write(df.loc[df[old_columns[i]].isnull(), :])
-
-
-    for i in range(len(old_columns)):
-        st.write(f"rows with nan for {old_columns[i]}")
-        st.write(df.loc[df[old_columns[i]].isnull(), :].shape)
-        st.write(df.loc[df[old_columns[i]].isnull(), :])
-
-        df.loc[df[old_columns[i]].isnull(), old_columns[i]] = df.loc[df[old_columns[i]].isnull(), new_columns[i]]
-
-        st.write("After")
-        st.write(df.loc[df[old_columns[i]].isnull(), :].shape)
-    
-    return df
-
-
 def main():
 
     st.header("Covid-19 visualizations")
@@ -149,11 +85,6 @@ def main():
     st.write(df.shape)
     st.write(df)
 
-    # df2 = merge_new_format(df)
-
-    # st.write("after modif")
-    # st.write(df2)
-
     df2 = preprocess_countries(df)
 
     df2 = fill_nan_lat_long(df2)
@@ -0,0 +1,42 @@
+import gzip
+import hashlib
+import json
+import os
+
+import plotly.io as pio
+
+from fetch import open_atomic
+
+# Figures pre-rendered by prerender.py, as gzipped Plotly JSON in one
+# directory per version of the data
+ARTIFACTS_DIR = os.environ.get(
+    "COVID_ARTIFACTS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".artifacts")
+)
+
+
+def get_artifacts_dir(datasets, artifacts_dir=ARTIFACTS_DIR):
+    # Figures can depend on several sources, the directory changes with any of their versions
+    versions = ":".join(dataset.version for dataset in datasets)
+    return os.path.join(artifacts_dir, hashlib.sha1(versions.encode("utf-8")).hexdigest()[:16])
+
+
+def get_artifact_path(directory, kind, *key):
+    # key holds the arguments the figure was built with, hashed since country
+    # names can contain characters that aren't valid in file names
+    key_hash = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"{kind}_{key_hash}.json.gz")
+
+
+def write_figure(path, fig):
+    # mtime=0 so the same figure always gives the same bytes
+    with open_atomic(path) as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            gz.write(pio.to_json(fig, validate=False).encode("utf-8"))
+
+
+def read_figure(path):
+    # As a dict: it's validated once, when Streamlit sends it, instead of
+    # also being turned into a Figure here
+    with gzip.open(path, "rb") as f:
+        return json.load(f)
@@ -0,0 +1,247 @@
+"""Benchmarks of the data and figure functions of app.py.
+
+Runs offline on synthetic, JHU-shaped time series served from a local HTTP
+server, with the app caches cleared before every call ("cold") or warmed up
+first ("cached"). Records the best wall time and the peak traced memory of
+each function, compares them with the stored baselines and exits with 1 when
+one of them regressed.
+
+    python benchmarks/bench.py                    # all scenarios
+    python benchmarks/bench.py --scenario today   # one scenario
+    python benchmarks/bench.py --save             # store new baselines
+
+The animated map is also checked against its budget (app.MAX_MAP_BYTES of
+figure JSON built in app.MAX_MAP_SECONDS) for every timeline offered, at
+the row count of the global time series. Going over it fails the run too.
+"""
+import argparse
+import datetime
+import functools
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, ".fixtures")
+BASELINES_PATH = os.path.join(BENCHMARKS_DIR, "baselines.json")
+
+# The app's download cache must point to a scratch directory before it is imported
+CACHE_DIR = tempfile.mkdtemp(prefix="covid-bench-")
+os.environ["COVID_CACHE_DIR"] = CACHE_DIR
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import app  # noqa: E402
+from cache import clear_caches  # noqa: E402
+
+# (rows, dates) of the global time series, roughly as of early 2023
+TODAY = (290, 1140)
+SCENARIOS = {
+    "today": TODAY,
+    "10x_dates": (TODAY[0], TODAY[1] * 10),
+    # US counties scale
+    "100x_rows": (TODAY[0] * 100, TODAY[1]),
+}
+N_COUNTRIES = 200
+SCALE = 0.0007
+REPEATS = 3
+# Relative slowdown or memory growth flagged as a regression, and the
+# absolute differences below which timer and allocator noise is ignored
+THRESHOLD = 0.25
+NOISE = {"time": 0.002, "peak": 1e6}
+
+
+def make_fixture(n_rows, n_dates, seed):
+    # Cumulative counts with a few downward corrections, some countries
+    # split into provinces, and quoted names containing commas
+    rng = np.random.default_rng(seed)
+
+    countries = [f"Country {i:03d}" for i in range(N_COUNTRIES)]
+    countries[0] = "Korea, South"
+    country = [countries[i % N_COUNTRIES] for i in range(n_rows)]
+    province = [np.nan if i < N_COUNTRIES else f"Province {i}" for i in range(n_rows)]
+
+    start = datetime.date(2020, 1, 22)
+    dates = [start + datetime.timedelta(days=n) for n in range(n_dates)]
+    columns = [f"{d.month}/{d.day}/{d:%y}" for d in dates]
+
+    daily = rng.poisson(rng.uniform(0, 50, size=(n_rows, 1)), size=(n_rows, n_dates))
+    corrections = rng.random((n_rows, n_dates)) < 0.001
+    daily[corrections] = -daily[corrections]
+    counts = np.cumsum(daily, axis=1)
+
+    df = pd.DataFrame(counts, columns=columns)
+    df.insert(0, "Long", rng.uniform(-180, 180, n_rows).round(4))
+    df.insert(0, "Lat", rng.uniform(-90, 90, n_rows).round(4))
+    df.insert(0, "Country/Region", country)
+    df.insert(0, "Province/State", province)
+    return df
+
+
+def get_fixture_path(name, n_rows, n_dates, seed):
+    path = os.path.join(FIXTURES_DIR, f"{name}_{n_rows}x{n_dates}.csv")
+    if not os.path.exists(path):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        make_fixture(n_rows, n_dates, seed).to_csv(path, index=False)
+    return path
+
+
+def serve_fixtures():
+    handler = functools.partial(_QuietHandler, directory=FIXTURES_DIR)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(func, prepare, repeats=REPEATS):
+    # Best wall time over the repeats, then the peak of traced memory in a
+    # separate run since tracing slows down allocations
+    best_time = float("inf")
+    for _ in range(repeats):
+        prepare()
+        start = time.perf_counter()
+        func()
+        best_time = min(best_time, time.perf_counter() - start)
+
+    prepare()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"time": best_time, "peak": peak}
+
+
+def get_fixture_urls(base_url, n_rows, n_dates):
+    return (
+        base_url + os.path.basename(get_fixture_path("confirmed", n_rows, n_dates, 0)),
+        base_url + os.path.basename(get_fixture_path("deaths", n_rows, n_dates, 1)),
+    )
+
+
+def get_cases(base_url, n_rows, n_dates):
+    confirmed_url, deaths_url = get_fixture_urls(base_url, n_rows, n_dates)
+    confirmed, deaths = app.load_datasets(confirmed_url, deaths_url)
+    countries = tuple(app.get_top_countries(confirmed, n=20))
+
+    return {
+        "load_data": lambda: app.load_data(confirmed_url),
+        "get_top_countries": lambda: app.get_top_countries(confirmed, n=20),
+        "get_df_plot": lambda: [app.get_df_plot(confirmed.cube, country) for country in countries],
+        "get_map_plot": lambda: app.get_map_plot(confirmed, SCALE),
+        "get_fig": lambda: app.get_fig(confirmed, countries, "Standard"),
+        "get_mortality_cube": lambda: app.get_mortality_cube(confirmed, deaths),
+        "get_df_mortality_rate": lambda: app.get_df_mortality_rate(confirmed, deaths),
+        "get_fig_country": lambda: app.get_fig_country(countries[0], confirmed, deaths),
+    }
+
+
+def clear_download_cache():
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+def run_scenario(base_url, n_rows, n_dates):
+    results = {}
+    for name, func in get_cases(base_url, n_rows, n_dates).items():
+        def cold():
+            clear_caches()
+            if name == "load_data":
+                clear_download_cache()
+
+        results[f"{name}/cold"] = measure(func, cold)
+
+        func()
+        results[f"{name}/cached"] = measure(func, lambda: None)
+    return results
+
+
+def check_map_budget(base_url, n_rows, n_dates):
+    # Cold build time and JSON size of the animated map, per timeline.
+    # Returns the timelines over budget.
+    confirmed, _ = app.load_datasets(*get_fixture_urls(base_url, n_rows, n_dates))
+    over_budget = []
+    for label, step in app.get_map_timelines(n_dates).items():
+        result = measure(lambda: app.get_map_animation(confirmed, SCALE, step), clear_caches)
+        fig = app.get_map_animation(confirmed, SCALE, step)
+        size = len(fig.to_json())
+        flag = ""
+        if size > app.MAX_MAP_BYTES or result["time"] > app.MAX_MAP_SECONDS:
+            flag = " OVER BUDGET"
+            over_budget.append(label)
+        print(f"map budget {label:20s} {len(fig.frames):5d} frames {1000 * result['time']:10.2f} ms {size / 1e6:10.2f} MB{flag}")
+    return over_budget
+
+
+def compare(results, baselines, threshold):
+    regressions = []
+    for key, result in sorted(results.items()):
+        baseline = baselines.get(key)
+        flag = ""
+        if baseline is not None:
+            for metric in ("time", "peak"):
+                slower = result[metric] > baseline[metric] * (1 + threshold)
+                if slower and result[metric] - baseline[metric] > NOISE[metric]:
+                    flag += f" REGRESSION {metric} ({result[metric] / baseline[metric]:.2f}x)"
+                    regressions.append(key)
+        print(f"{key:45s} {1000 * result['time']:10.2f} ms {result['peak'] / 1e6:10.2f} MB{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    server, base_url = serve_fixtures()
+    results = {}
+    over_budget = []
+    try:
+        for scenario in args.scenario or list(SCENARIOS):
+            n_rows, n_dates = SCENARIOS[scenario]
+            print(f"# {scenario}: {n_rows} rows x {n_dates} dates")
+            scenario_results = {
+                f"{scenario}/{key}": result
+                for key, result in run_scenario(base_url, n_rows, n_dates).items()
+            }
+            results.update(scenario_results)
+            # The map animates the global time series only
+            if n_rows == TODAY[0]:
+                over_budget += check_map_budget(base_url, n_rows, n_dates)
+    finally:
+        server.shutdown()
+        clear_download_cache()
+
+    regressions = compare(results, baselines, args.threshold)
+
+    if args.save:
+        baselines.update(results)
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Baselines saved to {BASELINES_PATH}")
+    if over_budget or (regressions and not args.save):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Load test of the JSON API (api.py) running locally.
+
+Sends a mix of requests over every route from concurrent clients, each with
+its own connection, and reports the throughput and the latency percentiles.
+
+    python api.py --port 8000 &
+    python benchmarks/load_api.py --url http://127.0.0.1:8000 --clients 16
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+def get_paths(base_url, n_countries=20):
+    countries = requests.get(base_url + "/api/countries").json()[:n_countries]
+    paths = ["/api/countries"]
+    for data in ("confirmed", "deaths", "mortality"):
+        paths.append(f"/api/top?data={data}&n=7")
+        paths.append(f"/api/map?data={data}")
+        paths.extend(f"/api/series?data={data}&country={country}" for country in countries)
+    return paths
+
+
+def run_client(base_url, paths, n_requests, gzip, latencies, errors, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    headers = {"Accept-Encoding": "gzip" if gzip else "identity"}
+    for _ in range(n_requests):
+        start = time.perf_counter()
+        response = session.get(base_url + rng.choice(paths), headers=headers)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--no-gzip", action="store_true")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    paths = get_paths(base_url)
+    latencies, errors = [], []
+
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(base_url, paths, args.requests, not args.no_gzip, latencies, errors, seed)
+        )
+        for seed in range(args.clients)
+    ]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = 1000 * np.percentile(latencies, [50, 95, 99])
+    print(f"{len(latencies)} requests in {elapsed:.2f} s, {len(latencies) / elapsed:.0f} requests/s, {len(errors)} errors")
+    print(f"latency p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import functools
+import itertools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from monitoring import count_cache, count_evictions, set_cache_bytes, span
+
+# Default limits of each cache, a value bigger than max_bytes isn't cached
+MAX_ENTRIES = int(os.environ.get("COVID_CACHE_MAX_ENTRIES", "256"))
+MAX_BYTES = int(float(os.environ.get("COVID_CACHE_MAX_MB", "64")) * 1e6)
+# Budget shared by all the caches of the process: above it, the least
+# recently used entries of all caches are evicted
+TOTAL_MAX_BYTES = int(float(os.environ.get("COVID_CACHE_TOTAL_MB", "256")) * 1e6)
+
+# Caches by function name. Streamlit executes app.py again on every rerun,
+# and api.py imports it as another module: the functions they define find
+# the entries already there instead of starting empty.
+_caches = {}
+_registry_lock = threading.Lock()
+# Latest version of each data source, see set_version
+_versions = {}
+# Last use of the entries, comparable across caches
+_ticks = itertools.count()
+
+
+class LRUCache:
+    # Evicts the least recently used entries beyond max_entries or max_bytes,
+    # and beyond TOTAL_MAX_BYTES for all caches (see enforce_total_budget).
+    # max_bytes None is no limit at all, the cache is left out of the budget.
+    # Every entry remembers the versions of the data its key refers to, so
+    # that they can be expired together.
+
+    def __init__(self, name, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        # Returns (hit, value)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, size, versions, _ = entry
+            self.entries[key] = (value, size, versions, next(_ticks))
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value, versions):
+        size = get_size(value)
+        if self.max_bytes is not None and (size > self.max_bytes or size > TOTAL_MAX_BYTES):
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, versions, next(_ticks))
+            self.bytes += size
+
+            evicted = 0
+            while len(self.entries) > 1 and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries)
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self.entries)))
+                evicted += 1
+            self.evictions += evicted
+        count_evictions(self.name, "lru", evicted)
+        set_cache_bytes(self.name, self.bytes)
+        enforce_total_budget()
+
+    def get_oldest(self):
+        # Last use of the least recently used entry, None when empty
+        with self.lock:
+            if not self.entries:
+                return None
+            return next(iter(self.entries.values()))[3]
+
+    def evict_oldest(self):
+        with self.lock:
+            if not self.entries:
+                return
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+        count_evictions(self.name, "budget", 1)
+        set_cache_bytes(self.name, self.bytes)
+
+    def expire(self, version):
+        # Drops the entries built from version, including the derived data
+        # whose version embeds it, like the mortality rates
+        with self.lock:
+            expired = [
+                key for key, (_, _, versions, _) in self.entries.items()
+                if any(version in v for v in versions)
+            ]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        count_evictions(self.name, "version", len(expired))
+        set_cache_bytes(self.name, self.bytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+        set_cache_bytes(self.name, 0)
+
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key):
+        _, size, _, _ = self.entries.pop(key)
+        self.bytes -= size
+
+
+def _is_mapped(array):
+    # Memory-mapped arrays live in the page cache, shared between processes
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def get_blocks(df):
+    # Columns are stored in blocks, one array for all the columns of a
+    # dtype, which pandas has no public API for. _data before pandas 1.1.
+    manager = df._mgr if hasattr(df, "_mgr") else df._data
+    return manager.blocks
+
+
+def get_size(value):
+    # Estimate of the memory held by a cached value, walked once when it is stored
+    if isinstance(value, np.ndarray):
+        return 0 if _is_mapped(value) else value.nbytes
+    if isinstance(value, pd.DataFrame):
+        # Numeric columns from their blocks, without the memory-mapped ones
+        # (the counts of a dataset). Only the others are measured column by
+        # column: the time series have over a thousand of them.
+        numeric = np.zeros(value.shape[1], dtype=bool)
+        size = 0
+        for block in get_blocks(value):
+            if isinstance(block.values, np.ndarray) and block.values.dtype.kind != "O":
+                numeric[block.mgr_locs.as_array] = True
+                size += 0 if _is_mapped(block.values) else block.values.nbytes
+        others = value.iloc[:, np.flatnonzero(~numeric)]
+        return size + int(others.memory_usage(deep=True).sum()) + get_size(value.columns)
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_size(k) + get_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_size(v) for v in value)
+    if hasattr(value, "to_plotly_json") and hasattr(value, "frames"):
+        # Traces and frames as the dicts they are sent as: copies, holding
+        # arrays of the same size, built once per miss. The layout is mostly
+        # the default template and isn't walked.
+        return get_size([trace.to_plotly_json() for trace in value.data]) + get_size(
+            [frame.to_plotly_json() for frame in value.frames]
+        )
+    return sys.getsizeof(value)
+
+
+def get_key(value, versions=None):
+    # Datasets are identified by their version token instead of being hashed,
+    # so building a key doesn't depend on the size of the data.
+    # The versions met are added to the versions set.
+    version = getattr(value, "version", None)
+    if version is not None:
+        if versions is not None:
+            versions.add(version)
+        return ("version", version)
+    if isinstance(value, dict):
+        return tuple((k, get_key(v, versions)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(get_key(v, versions) for v in value)
+    return value
+
+
+def cached(func=None, *, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    # Memoizes func on its (small, hashable) arguments, in an LRU cache named
+    # after it. Arguments with a version attribute are keyed on it.
+    #   @cached
+    #   @cached(max_entries=32)
+    if func is None:
+        return functools.partial(cached, max_entries=max_entries, max_bytes=max_bytes)
+
+    with _registry_lock:
+        if func.__name__ not in _caches:
+            _caches[func.__name__] = LRUCache(func.__name__, max_entries, max_bytes)
+        cache = _caches[func.__name__]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        versions = set()
+        key = (get_key(args, versions), get_key(sorted(kwargs.items()), versions))
+        hit, value = cache.get(key)
+        count_cache(func.__name__, hit)
+        if hit:
+            return value
+
+        with span(func.__name__, cache="miss"):
+            value = func(*args, **kwargs)
+        cache.put(key, value, frozenset(versions))
+        return value
+
+    wrapper.cache = cache
+    return wrapper
+
+
+def enforce_total_budget():
+    # Evicts the least recently used entries of all caches until they fit
+    # in TOTAL_MAX_BYTES together. The entry just stored is the most
+    # recently used one, and is never bigger than the budget on its own.
+    caches = get_budget_caches()
+    while sum(cache.bytes for cache in caches) > TOTAL_MAX_BYTES:
+        oldest = [(cache.get_oldest(), cache) for cache in caches]
+        oldest = [(tick, cache) for tick, cache in oldest if tick is not None]
+        if not oldest:
+            break
+        min(oldest, key=lambda item: item[0])[1].evict_oldest()
+
+
+def get_budget_caches():
+    # Caches sharing TOTAL_MAX_BYTES, the ones with a max_bytes
+    with _registry_lock:
+        return [cache for cache in _caches.values() if cache.max_bytes is not None]
+
+
+def get_total_bytes():
+    return sum(cache.bytes for cache in get_budget_caches())
+
+
+def set_version(source, version):
+    # Called with the version of source every time it is loaded. When it
+    # changed, the entries built from the previous one are expired.
+    with _registry_lock:
+        previous = _versions.get(source)
+        _versions[source] = version
+        caches = list(_caches.values())
+    if previous is not None and previous != version:
+        for cache in caches:
+            cache.expire(previous)
+
+
+def get_cache_stats():
+    with _registry_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.get_stats() for cache in caches}
+
+
+def clear_caches():
+    with _registry_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.clear()
@@ -0,0 +1,154 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+COUNTRY_COL = "Country/Region"
+PROVINCE_COL = "Province/State"
+META_COLS = [PROVINCE_COL, COUNTRY_COL, "Lat", "Long"]
+
+WORLDWIDE = "Worldwide"
+
+# Dense country x date matrix built once per dataset.
+# Row 0 is the Worldwide total, the other rows are the countries in sorted order.
+# index maps a country name to its row in values.
+Cube = namedtuple("Cube", ["countries", "index", "dates", "values"])
+
+
+def get_date_columns(df):
+    return [col for col in df.columns.tolist() if col not in META_COLS]
+
+
+def aggregate_rows(codes, counts, n_groups):
+    # Sum the rows of counts sharing the same code, in a single vectorized pass.
+    # codes must cover every group in range(n_groups), as pd.factorize guarantees.
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    aggregated = np.add.reduceat(counts[order], starts, axis=0)
+    assert len(aggregated) == n_groups
+    return aggregated
+
+
+def accumulate_rows(values, codes, counts):
+    # Adds each row of counts to the row of values given by its code. Unlike
+    # aggregate_rows, codes may miss some rows of values, so that a table
+    # read in chunks can be summed chunk by chunk.
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    values[sorted_codes[starts]] += np.add.reduceat(counts[order], starts, axis=0)
+
+
+def build_cube(df, dtype=None):
+    dates = get_date_columns(df)
+    integer = all(pd.api.types.is_integer_dtype(t) for t in df[dates].dtypes)
+    if dtype is None:
+        dtype = np.int64 if integer else np.float64
+    codes, countries = pd.factorize(df[COUNTRY_COL], sort=True)
+    # Integer columns can't hold NaN, no need to copy them through fillna
+    counts = df[dates] if integer else df[dates].fillna(0)
+    counts = counts.to_numpy(dtype=dtype)
+
+    values = np.empty((len(countries) + 1, len(dates)), dtype=dtype)
+    values[1:] = aggregate_rows(codes, counts, len(countries))
+    values[0] = values[1:].sum(axis=0)
+
+    countries = [WORLDWIDE] + [str(country) for country in countries]
+    index = {country: row for row, country in enumerate(countries)}
+
+    return Cube(countries, index, dates, values)
+
+
+def get_series(cube, country):
+    # A view on the country's row, no copy
+    return cube.values[cube.index[country]]
+
+
+def build_ranking(cube):
+    # For every date, the cube rows of the countries from most to least cases.
+    # Worldwide is left out. Ties keep the alphabetical order.
+    order = np.argsort(-cube.values[1:], axis=0, kind="stable")
+    return (order + 1).astype(np.int32)
+
+
+def get_top(cube, ranking, n, date_index=-1):
+    return [cube.countries[row] for row in ranking[:n, date_index]]
+
+
+def build_offsets(cube, threshold):
+    # For every row of the cube, the index of the first date with at least
+    # threshold cases, -1 when it was never reached. One argmax over the whole cube.
+    reached = cube.values >= threshold
+    offsets = reached.argmax(axis=1)
+    offsets[~reached[np.arange(len(offsets)), offsets]] = -1
+    return offsets
+
+
+ROLLING_WINDOW = 7
+
+# Derived series, all shaped like cube.values:
+# - daily: new cases per day, never negative
+# - corrections: the downward revisions of the cumulative counts by JHU,
+#   as negative numbers (daily + corrections is the day-to-day difference)
+# - rolling: mean of daily over the last ROLLING_WINDOW days
+# - growth: rolling divided by the previous day's total
+# - doubling: days for the total to double at the current growth rate
+Metrics = namedtuple("Metrics", ["daily", "corrections", "rolling", "growth", "doubling"])
+
+
+def build_metrics(cube, window=ROLLING_WINDOW):
+    values = cube.values.astype(np.float64)
+
+    increments = np.diff(values, axis=1, prepend=0)
+    daily = np.maximum(increments, 0)
+    corrections = np.minimum(increments, 0)
+
+    # Rolling mean from the cumulative sum, with partial windows at the start
+    total = np.cumsum(daily, axis=1)
+    shifted = np.zeros_like(total)
+    shifted[:, window:] = total[:, :-window]
+    lengths = np.minimum(np.arange(1, values.shape[1] + 1), window)
+    rolling = (total - shifted) / lengths
+
+    previous = np.zeros_like(values)
+    previous[:, 1:] = values[:, :-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(previous > 0, rolling / previous, np.nan)
+        doubling = np.where(growth > 0, np.log(2) / np.log1p(growth), np.nan)
+
+    return Metrics(daily, corrections, rolling, growth, doubling)
+
+
+def align_cubes(first, second):
+    # Both cubes on the union of their countries and on their common dates.
+    # A country missing from one cube gets zeros in it.
+    countries = [WORLDWIDE] + sorted(set(first.countries[1:]) | set(second.countries[1:]))
+    second_dates = set(second.dates)
+    dates = [date for date in first.dates if date in second_dates]
+
+    def align(cube):
+        values = np.zeros((len(countries), len(dates)), dtype=cube.values.dtype)
+        rows = [row for row, country in enumerate(countries) if country in cube.index]
+        source_rows = [cube.index[countries[row]] for row in rows]
+        date_index = {date: col for col, date in enumerate(cube.dates)}
+        source_cols = [date_index[date] for date in dates]
+        values[rows] = cube.values[np.ix_(source_rows, source_cols)]
+        return values
+
+    return countries, dates, align(first), align(second)
+
+
+def divide(numerator, denominator):
+    # NaN where the denominator is 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def build_mortality_cube(confirmed, deaths):
+    # Deaths / confirmed cases to date, for every country and date.
+    # Provinces are summed first, so countries whose provinces differ
+    # between the two sources still line up.
+    countries, dates, confirmed_values, deaths_values = align_cubes(confirmed, deaths)
+    index = {country: row for row, country in enumerate(countries)}
+    return Cube(countries, index, dates, divide(deaths_values, confirmed_values))
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def lttb(y, n_out):
+    # Indices of n_out points of y that keep the shape of the line, with
+    # Largest-Triangle-Three-Buckets (Steinarsson, 2013). Points are assumed
+    # evenly spaced, as dates are. The first and last points are always kept.
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.intp), n)
+
+    # Average point of each bucket, the last "bucket" being the last point
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x, edges[:-1]) / counts
+    avg_y = np.add.reduceat(y, edges[:-1]) / counts
+
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # Twice the area of the triangles (a, candidate, next bucket average)
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
@@ -0,0 +1,136 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter, namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    "COVID_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+# (connect, read) timeouts of a single request, in seconds
+TIMEOUT = (5, 30)
+RETRIES = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+POOL_SIZE = 8
+
+# hit: the server answered 304 and the file was read from disk
+# miss: the file was (re)downloaded
+# revalidation: a conditional request was sent for a file already on disk
+# fallback: the request failed and the cached copy was used instead
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+FetchResult = namedtuple("FetchResult", ["path", "status", "digest"])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def get_fetch_stats():
+    with _stats_lock:
+        return {key: _stats[key] for key in ("hit", "miss", "revalidation", "fallback")}
+
+
+def get_session():
+    # Shared by every thread, so that connections to the same host are reused
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=RETRIES)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def get_cache_path(url, cache_dir=CACHE_DIR):
+    # Prefix with a hash of the URL so two sources with the same file name don't collide
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{url_hash}_{os.path.basename(url)}")
+
+
+@contextlib.contextmanager
+def open_atomic(path):
+    # Readers never see a half-written file: write next to it, then rename over it
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_atomic(path, data):
+    with open_atomic(path) as f:
+        f.write(data)
+
+
+def _read_meta(path):
+    try:
+        with open(path + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch(url, cache_dir=CACHE_DIR, session=None, timeout=TIMEOUT):
+    # Returns the local path of an up-to-date copy of url.
+    # A copy already on disk is revalidated with ETag / If-Modified-Since.
+    path = get_cache_path(url, cache_dir)
+    meta = _read_meta(path) if os.path.exists(path) else None
+
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        _count("revalidation")
+
+    try:
+        response = (session or get_session()).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and meta is not None:
+            _count("hit")
+            logger.info("fetch %s: not modified, reading %s", url, path)
+            return FetchResult(path, "hit", meta["digest"])
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if meta is None:
+            raise
+        _count("fallback")
+        logger.warning("fetch %s failed (%s), falling back to %s", url, e, path)
+        return FetchResult(path, "fallback", meta["digest"])
+
+    content = response.content
+    digest = hashlib.sha1(content).hexdigest()
+    write_atomic(path, content)
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "digest": digest,
+    }
+    write_atomic(path + ".json", json.dumps(meta).encode("utf-8"))
+
+    _count("miss")
+    logger.info("fetch %s: downloaded %d bytes to %s", url, len(content), path)
+    return FetchResult(path, "miss", digest)
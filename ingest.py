@@ -0,0 +1,471 @@
+import csv
+import itertools
+import logging
+import os
+import threading
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cube import (
+    COUNTRY_COL, META_COLS, PROVINCE_COL,
+    Cube, accumulate_rows, aggregate_rows, build_cube, get_date_columns
+)
+from fetch import fetch, get_cache_path
+from monitoring import span, with_spans
+from quality import check_arrays, get_issues
+from snapshot import read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+CONFIRMED_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv"
+DEATHS_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_global.csv"
+RECOVERED_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_recovered_global.csv"
+US_CONFIRMED_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv"
+US_DEATHS_SOURCE = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv"
+
+# Set when worker.py keeps the snapshots up to date: app processes then only
+# read them (see open_snapshot) instead of fetching the sources themselves
+INGEST_WORKER = os.environ.get("COVID_INGEST_WORKER", "") not in ("", "0")
+# Set to also load the recovered cases, an extra choice of the World view
+LOAD_RECOVERED = os.environ.get("COVID_RECOVERED", "") not in ("", "0")
+
+# version is a cheap token identifying the data: the digest of the source
+# file and its last date. Cached functions are keyed on it.
+# quality is the report of the checks run at ingest time, see quality.py
+Dataset = namedtuple("Dataset", ["version", "frame", "cube", "quality"], defaults=[None])
+
+
+def get_version(digest, dates):
+    return f"{digest[:12]}/{dates[-1] if len(dates) else ''}"
+
+# Explicit schema for the metadata columns, the count columns get the
+# smallest integer type that holds their values (see compact_counts)
+SCHEMA = {
+    PROVINCE_COL: "category",
+    COUNTRY_COL: "category",
+    "Lat": np.float32,
+    "Long": np.float32,
+}
+COUNT_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+CHECKSUM_CHUNK_ROWS = 1000
+
+# The US files have a row per county and more metadata columns. Only the
+# county, its state and its coordinates are kept, under the names of the
+# global files: the county as the province and the state as the country,
+# so that the rows of the cube are the states and row 0 the national total.
+US_META_COLS = [
+    "UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State",
+    "Country_Region", "Lat", "Long_", "Combined_Key", "Population",
+]
+US_COLUMNS = {"Admin2": PROVINCE_COL, "Province_State": COUNTRY_COL, "Lat": "Lat", "Long_": "Long"}
+US_SCHEMA = {"Admin2": str, "Province_State": str, "Lat": np.float32, "Long_": np.float32}
+US_TOTAL = "United States"
+US_CHUNK_ROWS = 500
+
+
+def get_count_dtype(counts):
+    if counts.size == 0:
+        return COUNT_DTYPES[0]
+    low, high = counts.min(), counts.max()
+    for dtype in COUNT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return COUNT_DTYPES[-1]
+
+
+def compact_counts(df):
+    dates = get_date_columns(df)
+    counts = df[dates]
+    missing = int(counts.isna().to_numpy().sum())
+    if missing:
+        logger.warning("%d missing counts replaced by 0", missing)
+        counts = counts.fillna(0)
+
+    counts = counts.to_numpy()
+    dtype = get_count_dtype(counts)
+    compact = pd.DataFrame(counts.astype(dtype, copy=False), columns=dates, index=df.index)
+
+    return pd.concat([df.drop(columns=dates), compact], axis=1)
+
+
+def get_memory_usage(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def get_default_memory_usage(df):
+    # What df would take with the dtypes pandas picks without a schema:
+    # object columns for the names, 64-bit numbers for the coordinates and
+    # counts. Computed from df, to be logged next to get_memory_usage.
+    numeric = [col for col, dtype in df.dtypes.items() if isinstance(dtype, np.dtype) and dtype.kind in "iufM"]
+    others = df.drop(columns=numeric).astype(object)
+    return len(df) * 8 * len(numeric) + get_memory_usage(others)
+
+
+def read_source_csv(path):
+    return compact_counts(pd.read_csv(path, dtype=SCHEMA))
+
+
+def get_snapshot_path(csv_path):
+    return csv_path + ".snap"
+
+
+def arrays_to_frame(arrays):
+    # The counts block is wrapped, not copied, so it stays memory-mapped
+    dates = arrays["dates"].tolist()
+    df = pd.DataFrame(arrays["counts"], columns=dates, copy=False)
+
+    province = arrays["province"].astype(object)
+    province[province == ""] = np.nan
+    df.insert(0, "Long", arrays["long"].astype(SCHEMA["Long"], copy=False))
+    df.insert(0, "Lat", arrays["lat"].astype(SCHEMA["Lat"], copy=False))
+    df.insert(0, COUNTRY_COL, pd.Categorical(arrays["country"].astype(object)))
+    df.insert(0, PROVINCE_COL, pd.Categorical(province))
+
+    return df
+
+
+def read_columns(path):
+    with open(path, encoding="utf-8") as f:
+        return next(csv.reader([f.readline()]))
+
+
+def is_county_level(columns):
+    return "Admin2" in columns
+
+
+def read_county_csv(path, chunk_rows=US_CHUNK_ROWS):
+    # One pass over the file by chunks of rows. The counts of each chunk go
+    # straight into a preallocated int32 matrix and are added to the state
+    # totals, so the whole table is never held as int64 or as Python objects.
+    columns = read_columns(path)
+    dates = [col for col in columns if col not in US_META_COLS]
+    with open(path, encoding="utf-8") as f:
+        n_rows = sum(1 for line in f if line.strip()) - 1
+
+    counts = np.empty((n_rows, len(dates)), dtype=np.int32)
+    info = np.iinfo(counts.dtype)
+    state_index = {}
+    state_values = np.zeros((0, len(dates)), dtype=np.int64)
+    metas = []
+
+    start = 0
+    chunks = pd.read_csv(path, usecols=list(US_COLUMNS) + dates, dtype=US_SCHEMA, chunksize=chunk_rows)
+    for chunk in chunks:
+        values = chunk[dates].fillna(0).to_numpy()
+        if values.size and (values.min() < info.min or values.max() > info.max):
+            raise ValueError(f"{path}: counts out of the int32 range")
+        counts[start:start + len(values)] = values
+        start += len(values)
+
+        states = chunk["Province_State"].fillna("")
+        new_states = [state for state in states.unique() if state not in state_index]
+        if new_states:
+            for state in new_states:
+                state_index[state] = len(state_index)
+            state_values = np.vstack([state_values, np.zeros((len(new_states), len(dates)), dtype=np.int64)])
+        accumulate_rows(state_values, states.map(state_index).to_numpy(), values)
+
+        metas.append(chunk[list(US_COLUMNS)])
+
+    meta = pd.concat(metas, ignore_index=True).rename(columns=US_COLUMNS)
+    # Unassigned cases and cases "Out of" a state are located at (0, 0)
+    unlocated = (meta["Lat"] == 0) & (meta["Long"] == 0)
+    meta.loc[unlocated, ["Lat", "Long"]] = np.nan
+
+    df = pd.DataFrame(counts[:start], columns=dates, copy=False)
+    for col in reversed(META_COLS):
+        df.insert(0, col, meta[col].astype(SCHEMA[col]))
+
+    states = sorted(state_index)
+    values = np.empty((len(states) + 1, len(dates)), dtype=np.int64)
+    values[1:] = state_values[[state_index[state] for state in states]]
+    values[0] = values[1:].sum(axis=0)
+    countries = [US_TOTAL] + states
+    cube = Cube(countries, {country: row for row, country in enumerate(countries)}, dates, values)
+
+    return df, cube
+
+
+def get_checksums(path):
+    # Checksums of the raw CSV text: one for the metadata of all the rows,
+    # and one per date column. Comparing them with the stored ones tells which
+    # columns changed without parsing any number.
+    # Rows are read in chunks so that memory doesn't grow with the file.
+    with open(path, encoding="utf-8") as f:
+        columns = next(csv.reader([f.readline()]))
+        dates = [col for col in columns if col not in META_COLS]
+
+        row_checksum = 0
+        column_checksums = [0] * len(dates)
+        while True:
+            chunk = list(itertools.islice(f, CHECKSUM_CHUNK_ROWS))
+            if not chunk:
+                break
+
+            # Dates are the trailing columns and never contain a comma,
+            # unlike quoted country names such as "Korea, South"
+            rows = [line.rstrip("\r\n").rsplit(",", len(dates)) for line in chunk if line.strip()]
+            row_checksum = zlib.crc32("".join(row[0] + "\n" for row in rows).encode("utf-8"), row_checksum)
+            for j, column in enumerate(itertools.islice(zip(*rows), 1, None)):
+                column_checksums[j] = zlib.crc32(
+                    (",".join(column) + ",").encode("utf-8"), column_checksums[j]
+                )
+
+    return dates, row_checksum, np.array(column_checksums, dtype=np.uint32)
+
+
+def frame_to_arrays(df, cube):
+    dates = get_date_columns(df)
+    return {
+        "counts": df[dates].to_numpy(),
+        "country": df[COUNTRY_COL].astype(str).to_numpy(dtype=str),
+        # NaN provinces are stored as empty strings
+        "province": df[PROVINCE_COL].astype(object).fillna("").to_numpy(dtype=str),
+        "lat": df["Lat"].to_numpy(),
+        "long": df["Long"].to_numpy(),
+        "dates": np.asarray(dates, dtype=str),
+        # Row of the cube each row of counts is aggregated into
+        "codes": np.array([cube.index[country] for country in df[COUNTRY_COL].astype(str)], dtype=np.int32),
+        "cube_countries": np.asarray(cube.countries, dtype=str),
+        "cube_values": cube.values,
+    }
+
+
+def arrays_to_dataset(arrays, digest, quality=None):
+    countries = arrays["cube_countries"].tolist()
+    cube = Cube(
+        countries,
+        {country: row for row, country in enumerate(countries)},
+        arrays["dates"].tolist(),
+        arrays["cube_values"]
+    )
+    return Dataset(get_version(digest, cube.dates), arrays_to_frame(arrays), cube, quality)
+
+
+def update_arrays(snapshot, path, dates, row_checksum, checksums):
+    # Parses only the new trailing date columns and the revised ones, and
+    # re-aggregates only those columns of the cube.
+    # Returns None when the rows or the older dates changed.
+    arrays = snapshot.arrays
+    old_dates = arrays["dates"].tolist()
+    n_old = len(old_dates)
+    if row_checksum != snapshot.meta["row_checksum"] or dates[:n_old] != old_dates:
+        return None
+
+    revised = np.flatnonzero(checksums[:n_old] != arrays["checksums"])
+    columns = np.concatenate([revised, np.arange(n_old, len(dates))]).astype(np.intp)
+    column_names = [dates[j] for j in columns]
+    if not len(columns):
+        # Same rows and values in different bytes (line endings, quoting):
+        # the snapshot is only written again under the new digest
+        return dict(arrays, checksums=checksums)
+    if len(revised):
+        logger.info("revised columns: %s", [old_dates[j] for j in revised])
+
+    parsed = pd.read_csv(path, usecols=column_names)[column_names].fillna(0).to_numpy()
+    dtype = np.promote_types(arrays["counts"].dtype, get_count_dtype(parsed))
+
+    counts = np.empty((len(parsed), len(dates)), dtype=dtype)
+    counts[:, :n_old] = arrays["counts"]
+    counts[:, columns] = parsed
+
+    # Row 0 of the cube is Worldwide, so country codes start at 1
+    n_countries = len(arrays["cube_countries"]) - 1
+    cube_values = np.empty((n_countries + 1, len(dates)), dtype=np.int64)
+    cube_values[:, :n_old] = arrays["cube_values"]
+    cube_values[1:, columns] = aggregate_rows(arrays["codes"] - 1, counts[:, columns], n_countries)
+    cube_values[0, columns] = cube_values[1:, columns].sum(axis=0)
+
+    return dict(
+        arrays,
+        counts=counts,
+        dates=np.asarray(dates, dtype=str),
+        cube_values=cube_values,
+        checksums=checksums
+    )
+
+
+def load_source(url):
+    # Ingests url into a memory-mapped snapshot holding the rows and the
+    # country x date cube:
+    # - unchanged source: the snapshot is used as is
+    # - new dates or revised values: only those columns are parsed and aggregated
+    # - anything else (new rows, format change): full parse of the CSV
+    # - US county files: full parse by chunks of rows, see read_county_csv
+    with span("download"):
+        result = fetch(url)
+    snapshot_path = get_snapshot_path(result.path)
+
+    snapshot = read_snapshot(snapshot_path)
+    if snapshot is not None and snapshot.meta.get("source_digest") == result.digest:
+        with span("parse"):
+            dataset = arrays_to_dataset(snapshot.arrays, result.digest, snapshot.meta.get("quality"))
+        logger.info(
+            "load %s: using snapshot %s, %.2f MB in memory, %.2f MB with the default dtypes",
+            url, snapshot_path, get_memory_usage(dataset.frame) / 1e6, get_default_memory_usage(dataset.frame) / 1e6
+        )
+        return dataset
+
+    columns = read_columns(result.path)
+    if is_county_level(columns):
+        with span("parse"):
+            df, cube = read_county_csv(result.path)
+        # Without checksums, the next version is parsed in full
+        arrays = frame_to_arrays(df, cube)
+        meta = {}
+        logger.info("load %s: parsed %d counties", url, len(df))
+    else:
+        with span("parse"):
+            dates, row_checksum, checksums = get_checksums(result.path)
+
+        arrays = None
+        if snapshot is not None:
+            with span("parse"):
+                arrays = update_arrays(snapshot, result.path, dates, row_checksum, checksums)
+        if arrays is None:
+            with span("parse"):
+                df = read_source_csv(result.path)
+            with span("aggregate"):
+                cube = build_cube(df)
+            arrays = dict(frame_to_arrays(df, cube), checksums=checksums)
+            logger.info("load %s: parsed the whole CSV", url)
+        else:
+            logger.info("load %s: appended %d new dates", url, len(dates) - len(snapshot.arrays["dates"]))
+        meta = {"row_checksum": row_checksum}
+
+    # Checked against the previous version of the source, when there is one
+    with span("check"):
+        quality = check_arrays(arrays, columns, snapshot)
+    log_quality(url, quality)
+
+    with span("write snapshot"):
+        write_snapshot(
+            snapshot_path,
+            arrays,
+            dict(meta, source=url, source_digest=result.digest, quality=quality)
+        )
+        dataset = arrays_to_dataset(read_snapshot(snapshot_path).arrays, result.digest, quality)
+    logger.info(
+        "load %s: wrote snapshot %s, %.2f MB in memory, %.2f MB with the default dtypes",
+        url, snapshot_path, get_memory_usage(dataset.frame) / 1e6, get_default_memory_usage(dataset.frame) / 1e6
+    )
+
+    return dataset
+
+
+def log_quality(url, quality):
+    issues = get_issues(quality)
+    if issues:
+        logger.warning("check %s: %s", url, "; ".join(issues))
+    else:
+        logger.info("check %s: no issue in %.1f ms", url, 1000 * quality["seconds"])
+
+
+# Dataset last opened by open_snapshot, per source, with the stamp of its file
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def open_snapshot(url):
+    # Dataset of the snapshot of url as written by the ingest worker, without
+    # fetching anything. The worker swaps the file atomically, so a new
+    # version is a new inode: the file is only reopened when its stamp
+    # changes, and a rerun otherwise costs one stat.
+    # Returns None until the worker wrote a first snapshot.
+    path = get_snapshot_path(get_cache_path(url))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+
+    with _opened_lock:
+        opened = _opened.get(url)
+    if opened is not None and opened[0] == stamp:
+        return opened[1]
+
+    with span("open snapshot"):
+        snapshot = read_snapshot(path)
+        if snapshot is None:
+            return None
+        dataset = arrays_to_dataset(snapshot.arrays, snapshot.meta["source_digest"], snapshot.meta.get("quality"))
+    logger.info("open %s: snapshot %s, version %s", url, path, dataset.version)
+
+    # Only the latest version is kept, the pages of the older file are
+    # released once nothing references its arrays anymore
+    with _opened_lock:
+        _opened[url] = (stamp, dataset)
+    return dataset
+
+
+# Daily reports (csse_covid_19_daily_reports) changed their header twice.
+# Every variant is mapped to the original column names while parsing.
+DAILY_REPORT_COLUMNS = [
+    PROVINCE_COL,
+    COUNTRY_COL,
+    "Last Update",
+    "Confirmed",
+    "Deaths",
+    "Recovered",
+    "Latitude",
+    "Longitude",
+]
+DAILY_REPORT_ALIASES = {
+    "Province_State": PROVINCE_COL,
+    "Country_Region": COUNTRY_COL,
+    "Last_Update": "Last Update",
+    "Lat": "Latitude",
+    "Long_": "Longitude",
+}
+DAILY_REPORT_SCHEMA = {
+    "Confirmed": np.int32,
+    "Deaths": np.int32,
+    "Recovered": np.int32,
+    "Latitude": np.float32,
+    "Longitude": np.float32,
+}
+DAILY_REPORT_WORKERS = 8
+
+
+def get_daily_report_path(source, date):
+    # source is either the URL of the daily reports folder, fetched through
+    # the download cache, or a local directory holding the same files
+    if os.path.isdir(source):
+        return os.path.join(source, f"{date}.csv")
+    return fetch(source + date + ".csv").path
+
+
+def read_daily_report(source, date):
+    path = get_daily_report_path(source, date)
+    usecols = set(DAILY_REPORT_COLUMNS) | set(DAILY_REPORT_ALIASES)
+    df = pd.read_csv(path, usecols=lambda col: col in usecols)
+    df = df.rename(columns=DAILY_REPORT_ALIASES).reindex(columns=DAILY_REPORT_COLUMNS)
+
+    # Each file uses a single timestamp format, but it varies between files
+    df["Last Update"] = pd.to_datetime(df["Last Update"], errors="coerce")
+    for col in ["Confirmed", "Deaths", "Recovered"]:
+        df[col] = df[col].fillna(0)
+
+    return df.astype(DAILY_REPORT_SCHEMA)
+
+
+def load_daily_reports(source, dates, max_workers=DAILY_REPORT_WORKERS):
+    # Reads one report per date on a bounded thread pool, into a single
+    # long-format table with one row per location and update
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        dfs = list(executor.map(with_spans(lambda date: read_daily_report(source, date)), dates))
+
+    df = pd.concat(dfs, ignore_index=True).drop_duplicates(ignore_index=True)
+    for col in [PROVINCE_COL, COUNTRY_COL]:
+        df[col] = df[col].astype("category")
+
+    logger.info(
+        "loaded %d daily reports, %d rows, %.2f MB in memory, %.2f MB with the default dtypes",
+        len(dates), len(df), get_memory_usage(df) / 1e6, get_default_memory_usage(df) / 1e6
+    )
+    return df
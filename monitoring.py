@@ -0,0 +1,142 @@
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Side port of the Prometheus endpoint, 0 to disable it
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# Shows the per-rerun breakdown in the app
+DEBUG = os.environ.get("COVID_DEBUG", "") not in ("", "0")
+
+STAGE_SECONDS = Histogram(
+    "covid_stage_seconds",
+    "Time spent in each stage of loading the data and rendering the page",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+CACHE_REQUESTS = Counter(
+    "covid_cache_requests_total",
+    "Lookups in the app caches",
+    ["cache", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "covid_cache_evictions_total",
+    "Entries removed from the app caches: least recently used (lru), over the budget of all caches (budget), or on a new version of the data (version)",
+    ["cache", "reason"],
+)
+CACHE_BYTES = Gauge(
+    "covid_cache_bytes",
+    "Estimated size of the entries of the app caches",
+    ["cache"],
+)
+RSS_BYTES = Gauge(
+    "covid_resident_memory_bytes",
+    "Resident memory of the process",
+)
+
+_server_lock = threading.Lock()
+_server_started = False
+# Spans of the current Streamlit rerun, per script thread
+_local = threading.local()
+
+
+def get_rss():
+    # Current resident memory from /proc, peak resident memory elsewhere
+    if resource is None:
+        return 0
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+RSS_BYTES.set_function(get_rss)
+
+
+def start_metrics_server():
+    # Once per process. With several app processes on a host, only the first
+    # one gets the port.
+    global _server_started
+    with _server_lock:
+        if _server_started or not METRICS_PORT:
+            return
+        _server_started = True
+        try:
+            start_http_server(METRICS_PORT)
+            logger.info("Prometheus metrics on port %d", METRICS_PORT)
+        except OSError as e:
+            logger.warning("Prometheus metrics not exposed on port %d: %s", METRICS_PORT, e)
+
+
+def reset_spans():
+    _local.spans = []
+
+
+def get_spans():
+    return list(getattr(_local, "spans", []))
+
+
+def with_spans(func):
+    # func recording its spans into those of the calling thread, for the
+    # threads of a pool doing work of the current rerun
+    spans = getattr(_local, "spans", None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if spans is None:
+            return func(*args, **kwargs)
+        previous = getattr(_local, "spans", None)
+        _local.spans = spans
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if previous is None:
+                del _local.spans
+            else:
+                _local.spans = previous
+
+    return wrapper
+
+
+def _record(stage, seconds, cache):
+    if hasattr(_local, "spans"):
+        _local.spans.append({"stage": stage, "seconds": seconds, "cache": cache})
+
+
+@contextlib.contextmanager
+def span(stage, cache=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        _record(stage, elapsed, cache)
+
+
+def count_cache(name, hit):
+    CACHE_REQUESTS.labels(name, "hit" if hit else "miss").inc()
+    if hit:
+        _record(name, 0.0, "hit")
+
+
+def count_evictions(name, reason, n):
+    if n:
+        CACHE_EVICTIONS.labels(name, reason).inc(n)
+
+
+def set_cache_bytes(name, n_bytes):
+    CACHE_BYTES.labels(name).set(n_bytes)
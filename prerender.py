@@ -0,0 +1,132 @@
+"""Pre-renders the figures of app.py for the current version of the data.
+
+Builds every figure of the Country view, the default World view figures and
+the default map, across a process pool, and writes them as gzipped Plotly
+JSON in a directory per version of the data (see artifacts.py). The app
+serves these files instead of building the figures when they exist.
+
+    python prerender.py               # all the figures
+    python prerender.py --workers 2   # on 2 processes
+"""
+import argparse
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app
+from artifacts import ARTIFACTS_DIR, get_artifact_path, get_artifacts_dir, write_figure
+from ingest import CONFIRMED_SOURCE, DEATHS_SOURCE, open_snapshot
+
+logger = logging.getLogger("prerender")
+
+# Countries rendered by each task, so that a process isn't handed a single
+# small figure at a time
+CHUNK_SIZE = 8
+
+# Datasets of the pool processes, opened once by init_worker
+_datasets = None
+
+
+def get_default_tasks(confirmed, deaths):
+    # (kind, key) of the figures a new session shows with the default values
+    # of the widgets, key holding the arguments as in app.main
+    tasks = []
+    for data_choice in app.DATA_CHOICES:
+        data = app.get_data(data_choice, confirmed, deaths)
+        countries = app.get_top_countries(data, n=app.DEFAULT_TOP_N)
+        tasks.append(("fig", (data_choice, countries, "Standard", "Total", "Auto")))
+        tasks.append(("map", (data_choice, app.DEFAULT_BUBBLE_SIZE)))
+
+    # First country of the Country view
+    country = app.get_top_countries(confirmed, n=1)[0]
+    tasks.append(("country", (country,)))
+    tasks.append(("country_daily", (country,)))
+    return tasks
+
+
+def get_tasks(confirmed, deaths):
+    # Every figure: the defaults, then the Country view of every country
+    tasks = get_default_tasks(confirmed, deaths)
+    for country in app.get_countries(confirmed):
+        for kind in ("country", "country_daily"):
+            if (kind, (country,)) not in tasks:
+                tasks.append((kind, (country,)))
+    return tasks
+
+
+def build_figure(kind, key, confirmed, deaths):
+    if kind == "fig":
+        data_choice, countries, log_scale_choice, plot_choice, render_choice = key
+        data = app.get_data(data_choice, confirmed, deaths)
+        return app.get_fig(data, tuple(countries), log_scale_choice, plot_choice, render_choice)
+    if kind == "map":
+        data_choice, bubble_size_int = key
+        data = app.get_map_data(data_choice, confirmed, deaths)
+        return app.get_map_plot(data, app.MAP_SCALES[bubble_size_int - 1])
+    if kind == "country":
+        return app.get_fig_country(key[0], confirmed, deaths)[1]
+    if kind == "country_daily":
+        return app.get_fig_country_daily(key[0], confirmed, deaths)[1]
+    raise ValueError(f"Unknown figure: {kind}")
+
+
+def init_worker(versions):
+    # The snapshots written by the parent are memory-mapped, not fetched again
+    global _datasets
+    _datasets = [open_snapshot(url) for url in (CONFIRMED_SOURCE, DEATHS_SOURCE)]
+    if [dataset.version for dataset in _datasets] != versions:
+        raise RuntimeError("The data changed during the pre-rendering, run it again")
+
+
+def render(directory, tasks):
+    confirmed, deaths = _datasets
+    n_bytes = 0
+    for kind, key in tasks:
+        path = get_artifact_path(directory, kind, *key)
+        write_figure(path, build_figure(kind, key, confirmed, deaths))
+        n_bytes += os.path.getsize(path)
+    return len(tasks), n_bytes
+
+
+def remove_older(directory):
+    # Directories of the previous versions, the app only looks up the current one
+    for name in os.listdir(ARTIFACTS_DIR):
+        path = os.path.join(ARTIFACTS_DIR, name)
+        if path != directory and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info("removed %s", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--keep", action="store_true", help="keep the figures of older versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    start = time.perf_counter()
+    confirmed, deaths = app.load_datasets(CONFIRMED_SOURCE, DEATHS_SOURCE)
+    directory = get_artifacts_dir((confirmed, deaths))
+    tasks = get_tasks(confirmed, deaths)
+    chunks = [tasks[i:i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+    logger.info("rendering %d figures to %s on %d processes", len(tasks), directory, args.workers)
+
+    n_figures = n_bytes = 0
+    versions = [confirmed.version, deaths.version]
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(versions,)) as executor:
+        for n, size in executor.map(render, [directory] * len(chunks), chunks):
+            n_figures += n
+            n_bytes += size
+
+    if not args.keep:
+        remove_older(directory)
+    logger.info(
+        "wrote %d figures, %.2f MB, in %.1f s", n_figures, n_bytes / 1e6, time.perf_counter() - start
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# Data-quality checks of an ingested dataset, run on its arrays (see
+# ingest.frame_to_arrays) as whole-matrix operations. The report is a plain,
+# JSON-serializable dict stored in the snapshot metadata:
+#   decreases: days on which a cumulative count went down (JHU corrections)
+#   negatives: negative counts
+#   countries: unknown (not in the previous version), removed and renamed countries
+#   coordinates: locations without latitude / longitude, or at (0, 0)
+#   header: metadata columns, whether they changed, date columns that
+#       aren't dates and missing days
+MAX_EXAMPLES = 5
+DATE_FORMAT = "%m/%d/%y"
+
+
+def get_location(arrays, row):
+    province = arrays["province"][row]
+    country = str(arrays["country"][row])
+    return f"{country} / {province}" if province else country
+
+
+def summarize(arrays, rows, cols, values):
+    # Count of the flagged cells, of the locations they are in, and the
+    # largest of them in absolute value
+    worst = np.argsort(np.abs(values), kind="stable")[::-1][:MAX_EXAMPLES]
+    return {
+        "count": int(len(rows)),
+        "locations": int(len(np.unique(rows))),
+        "examples": [
+            {"location": get_location(arrays, rows[i]), "date": str(arrays["dates"][cols[i]]), "value": int(values[i])}
+            for i in worst
+        ],
+    }
+
+
+def find(mask):
+    # Rows and columns of the true cells of a 2D mask, np.nonzero is several
+    # times slower than on the flattened mask
+    return np.divmod(np.flatnonzero(mask), mask.shape[1])
+
+
+def check_decreases(arrays):
+    counts = arrays["counts"]
+    rows, cols = find(counts[:, 1:] < counts[:, :-1])
+    deltas = counts[rows, cols + 1].astype(np.int64) - counts[rows, cols]
+    return summarize(arrays, rows, cols + 1, deltas)
+
+
+def check_negatives(arrays):
+    counts = arrays["counts"]
+    rows, cols = find(counts < 0)
+    return summarize(arrays, rows, cols, counts[rows, cols])
+
+
+def check_coordinates(arrays):
+    lat = arrays["lat"].astype(np.float64)
+    long = arrays["long"].astype(np.float64)
+    rows = np.flatnonzero(np.isnan(lat) | np.isnan(long) | ((lat == 0) & (long == 0)))
+    return {
+        "count": int(len(rows)),
+        "examples": [get_location(arrays, row) for row in rows[:MAX_EXAMPLES]],
+    }
+
+
+def get_locations(arrays, countries):
+    keep = np.isin(arrays["country"], countries)
+    return pd.DataFrame({
+        "country": arrays["country"][keep],
+        "province": arrays["province"][keep],
+        "lat": np.round(arrays["lat"][keep].astype(np.float64), 2),
+        "long": np.round(arrays["long"][keep].astype(np.float64), 2),
+    })
+
+
+def check_countries(arrays, previous):
+    # Compared with the previous version, None without one. A country that
+    # disappeared while a new one appeared at the same locations was renamed.
+    if previous is None:
+        return None
+    current = set(np.unique(arrays["country"]).tolist())
+    old = set(np.unique(previous["country"]).tolist())
+    added = sorted(current - old)
+    removed = sorted(old - current)
+
+    renamed = []
+    if added and removed:
+        pairs = get_locations(previous, removed).merge(
+            get_locations(arrays, added), on=["province", "lat", "long"], suffixes=("_from", "_to")
+        )
+        pairs = pairs[["country_from", "country_to"]].drop_duplicates()
+        renamed = [{"from": old_name, "to": new_name} for old_name, new_name in pairs.itertuples(index=False)]
+
+    renamed_from = {pair["from"] for pair in renamed}
+    renamed_to = {pair["to"] for pair in renamed}
+    return {
+        "unknown": [country for country in added if country not in renamed_to],
+        "removed": [country for country in removed if country not in renamed_from],
+        "renamed": renamed,
+    }
+
+
+def check_header(columns, dates, previous_columns):
+    # The header is made of the columns that aren't dates: a new metadata
+    # column parsed as a date by ingest is both a header change and an
+    # invalid date
+    parsed = pd.to_datetime(pd.Series(columns, dtype=object), format=DATE_FORMAT, errors="coerce")
+    is_date = parsed.notna().to_numpy()
+    header = np.asarray(columns, dtype=object)[~is_date].tolist()
+    header_set = set(header)
+
+    valid_dates = parsed[is_date]
+    steps = valid_dates.diff().dt.days.to_numpy()[1:]
+    gaps = np.asarray(columns, dtype=object)[is_date][1:][steps != 1]
+
+    return {
+        "columns": header,
+        "changed": previous_columns is not None and header != previous_columns,
+        "invalid_dates": [date for date in dates if date in header_set],
+        "gaps": gaps[:MAX_EXAMPLES].tolist(),
+    }
+
+
+def check_arrays(arrays, columns, previous=None):
+    # columns is the header of the source file, previous the snapshot of the
+    # previous version, if any
+    start = time.perf_counter()
+    previous_quality = previous.meta.get("quality") if previous is not None else None
+    previous_columns = previous_quality["header"]["columns"] if previous_quality else None
+
+    report = {
+        "rows": int(arrays["counts"].shape[0]),
+        "dates": int(arrays["counts"].shape[1]),
+        "decreases": check_decreases(arrays),
+        "negatives": check_negatives(arrays),
+        "countries": check_countries(arrays, previous.arrays if previous is not None else None),
+        "coordinates": check_coordinates(arrays),
+        "header": check_header(columns, arrays["dates"].tolist(), previous_columns),
+    }
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def get_issues(report):
+    # One line per kind of finding, empty when there is nothing to report
+    issues = []
+    if report["decreases"]["count"]:
+        issues.append(
+            f"{report['decreases']['count']} decreases of cumulative counts "
+            f"in {report['decreases']['locations']} locations"
+        )
+    if report["negatives"]["count"]:
+        issues.append(f"{report['negatives']['count']} negative counts in {report['negatives']['locations']} locations")
+    countries = report["countries"]
+    if countries is not None:
+        if countries["renamed"]:
+            issues.append("renamed: " + ", ".join(f"{pair['from']} -> {pair['to']}" for pair in countries["renamed"]))
+        if countries["unknown"]:
+            issues.append("unknown countries: " + ", ".join(countries["unknown"]))
+        if countries["removed"]:
+            issues.append("removed countries: " + ", ".join(countries["removed"]))
+    if report["coordinates"]["count"]:
+        issues.append(f"{report['coordinates']['count']} locations without coordinates")
+    header = report["header"]
+    if header["changed"]:
+        issues.append("header changed: " + ", ".join(header["columns"]))
+    if header["invalid_dates"]:
+        issues.append("invalid dates: " + ", ".join(header["invalid_dates"]))
+    if header["gaps"]:
+        issues.append("missing days before: " + ", ".join(header["gaps"]))
+    return issues
@@ -0,0 +1,85 @@
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from fetch import open_atomic
+
+# Binary snapshot of an ingested dataset, laid out so it can be memory-mapped:
+#
+#   MAGIC | format version (uint32) | header length (uint32) | JSON header | blocks
+#
+# The JSON header holds free-form metadata and, for every array, its dtype,
+# shape and offset in the file. Each block is the raw C-ordered array data,
+# aligned on ALIGNMENT bytes.
+MAGIC = b"COVIDSNP"
+# Bump on any change of layout or of the arrays stored, readers then ignore
+# older files and the snapshot gets rebuilt from the CSV
+FORMAT_VERSION = 4
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<8sII")
+
+Snapshot = namedtuple("Snapshot", ["meta", "arrays"])
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(path, arrays, meta):
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # Offsets are relative to the first block, which starts right after the header
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({"meta": meta, "arrays": layout}).encode("utf-8")
+    start = _align(_PREFIX.size + len(header))
+
+    # Arrays are streamed to the file, without an in-memory copy
+    with open_atomic(path) as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            array.tofile(f)
+
+
+def read_header(path):
+    # Returns None when the file is missing or written by another format version
+    try:
+        with open(path, "rb") as f:
+            magic, version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            header = json.loads(f.read(header_length).decode("utf-8"))
+    except (OSError, struct.error, ValueError):
+        return None
+
+    header["start"] = _align(_PREFIX.size + header_length)
+    return header
+
+
+def read_snapshot(path):
+    # Arrays are read-only memory maps: nothing is parsed or copied, and
+    # processes mapping the same file share its pages
+    header = read_header(path)
+    if header is None:
+        return None
+
+    arrays = {}
+    for name, block in header["arrays"].items():
+        shape = tuple(block["shape"])
+        if 0 in shape:
+            arrays[name] = np.empty(shape, dtype=block["dtype"])
+        else:
+            arrays[name] = np.memmap(
+                path, dtype=block["dtype"], mode="r", offset=header["start"] + block["offset"], shape=shape
+            )
+
+    return Snapshot(header["meta"], arrays)
@@ -0,0 +1,90 @@
+import functools
+import hashlib
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetch  # noqa: E402
+import ingest  # noqa: E402
+
+
+class StandInServer:
+    # Serves files from memory with an ETag, like raw.githubusercontent.com.
+    # Set status to answer every request with an error instead.
+
+    def __init__(self):
+        self.files = {}
+        self.status = None
+        self.requests = []
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def make_handler(self):
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                stand_in.requests.append((self.path, dict(self.headers)))
+                if stand_in.status is not None:
+                    self.send_response(stand_in.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path not in stand_in.files:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = stand_in.files[self.path]
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server():
+    stand_in = StandInServer()
+    stand_in.start()
+    yield stand_in
+    stand_in.stop()
+
+
+@pytest.fixture
+def session():
+    # Without the retries of fetch.get_session, errors are reported at once
+    with requests.Session() as s:
+        yield s
+
+
+@pytest.fixture
+def local_fetch(monkeypatch, tmp_path, session):
+    # load_source downloads into tmp_path
+    monkeypatch.setattr(ingest, "fetch", functools.partial(fetch.fetch, cache_dir=str(tmp_path), session=session))
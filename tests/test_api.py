@@ -0,0 +1,93 @@
+import json
+import threading
+
+import pytest
+
+import api
+import app
+import ingest
+from cube import build_cube
+
+CSV = b"""Province/State,Country/Region,Lat,Long,1/22/20,1/23/20
+,Afghanistan,33.0,65.0,0,1
+Hubei,China,30.97,112.27,444,549
+,Diamond Princess,,,61,61
+"""
+
+
+def make_dataset(tmp_path, name, version):
+    path = tmp_path / f"{name}.csv"
+    path.write_bytes(CSV)
+    df = ingest.read_source_csv(str(path))
+    return ingest.Dataset(version, df, build_cube(df))
+
+
+def strict_loads(body):
+    def reject(constant):
+        raise ValueError(f"invalid JSON constant {constant}")
+    return json.loads(body, parse_constant=reject)
+
+
+@pytest.fixture
+def datasets(tmp_path, request):
+    # Versions unique per test, get_response is cached on them
+    return make_dataset(tmp_path, "confirmed", f"c/{request.node.name}"), make_dataset(tmp_path, "deaths", f"d/{request.node.name}")
+
+
+def test_map_without_coordinates_is_valid_json(datasets):
+    confirmed, deaths = datasets
+    body, _ = api.get_response(confirmed, deaths, "/api/map", (("data", "confirmed"),))
+    points = strict_loads(body)
+    assert points["lat"] == [33.0, 30.97, None]
+    assert points["long"] == [65.0, 112.27, None]
+
+
+def test_mortality_without_cases_is_valid_json(datasets):
+    confirmed, deaths = datasets
+    body, _ = api.get_response(confirmed, deaths, "/api/map", (("data", "mortality"), ("date", "1/22/20")))
+    assert strict_loads(body)["values"][0] is None
+
+
+@pytest.fixture
+def api_url(monkeypatch, datasets):
+    monkeypatch.setattr(api, "get_datasets", lambda: datasets)
+    server = api.serve(0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_gzip_and_identity_bodies_have_their_own_etag(api_url, session, monkeypatch):
+    monkeypatch.setattr(api, "MIN_GZIP_BYTES", 0)
+    url = api_url + "/api/map"
+    plain = session.get(url, headers={"Accept-Encoding": "identity"})
+    zipped = session.get(url, headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] != zipped.headers["ETag"]
+
+    # Each tag only validates its own representation
+    again = session.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]})
+    assert again.status_code == 304
+    other = session.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert other.status_code == 200
+    assert other.content == plain.content
+
+
+def test_unavailable_data_is_a_503(api_url, session, monkeypatch):
+    def get_datasets():
+        raise ConnectionError("network down")
+    monkeypatch.setattr(api, "get_datasets", get_datasets)
+    response = session.get(api_url + "/api/countries")
+    assert response.status_code == 503
+    assert "error" in response.json()
+
+
+def test_series_does_not_build_the_location_frame(datasets, monkeypatch):
+    def get_df_mortality_rate(confirmed, deaths):
+        raise AssertionError("per-location frame built for /api/series")
+    monkeypatch.setattr(app, "get_df_mortality_rate", get_df_mortality_rate)
+    confirmed, deaths = datasets
+    body, _ = api.get_response(confirmed, deaths, "/api/series", (("country", "China"), ("data", "mortality")))
+    assert strict_loads(body)["values"] == [1.0, 1.0]
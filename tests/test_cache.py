@@ -0,0 +1,115 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+from cache import LRUCache, cached, get_size, get_total_bytes, set_version
+
+Data = namedtuple("Data", ["version"])
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    # Caches and versions of their own, apart from the ones of app.py
+    monkeypatch.setattr(cache, "_caches", {})
+    monkeypatch.setattr(cache, "_versions", {})
+
+
+def make_value(n_bytes):
+    return np.zeros(n_bytes, dtype=np.uint8)
+
+
+def make_cache(name, max_entries=None, max_bytes=1000):
+    # Registered like the caches of @cached, to share the budget
+    cache._caches[name] = LRUCache(name, max_entries, max_bytes)
+    return cache._caches[name]
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = make_cache("lru", max_entries=2)
+    lru.put("a", make_value(10), frozenset())
+    lru.put("b", make_value(10), frozenset())
+    lru.get("a")
+    lru.put("c", make_value(10), frozenset())
+    assert list(lru.entries) == ["a", "c"]
+    assert lru.get_stats()["evictions"] == 1
+
+
+def test_max_bytes():
+    lru = make_cache("lru", max_bytes=100)
+    lru.put("a", make_value(60), frozenset())
+    lru.put("b", make_value(60), frozenset())
+    assert list(lru.entries) == ["b"]
+    assert lru.bytes == 60
+
+    # Bigger than the cache on its own: not stored
+    lru.put("c", make_value(200), frozenset())
+    assert list(lru.entries) == ["b"]
+
+
+def test_total_budget_evicts_the_oldest_entry_of_all_caches(monkeypatch):
+    monkeypatch.setattr(cache, "TOTAL_MAX_BYTES", 100)
+    first = make_cache("first")
+    second = make_cache("second")
+    first.put("a", make_value(40), frozenset())
+    second.put("b", make_value(40), frozenset())
+    first.get("a")
+    first.put("c", make_value(40), frozenset())
+    assert list(first.entries) == ["a", "c"]
+    assert list(second.entries) == []
+    assert get_total_bytes() == 80
+
+
+def test_unbounded_cache_is_out_of_the_budget(monkeypatch):
+    monkeypatch.setattr(cache, "TOTAL_MAX_BYTES", 100)
+    bounded = make_cache("bounded")
+    unbounded = make_cache("unbounded", max_bytes=None)
+    bounded.put("a", make_value(40), frozenset())
+    unbounded.put("b", make_value(400), frozenset())
+    assert list(bounded.entries) == ["a"]
+    assert list(unbounded.entries) == ["b"]
+    assert get_total_bytes() == 40
+
+
+def test_new_version_expires_the_entries_built_from_the_previous_one():
+    calls = []
+
+    @cached
+    def rate(confirmed, deaths):
+        calls.append((confirmed.version, deaths.version))
+        return Data(f"mortality:{confirmed.version}:{deaths.version}")
+
+    @cached
+    def top(data):
+        return data.version
+
+    set_version("confirmed", "c1")
+    set_version("deaths", "d1")
+    top(rate(Data("c1"), Data("d1")))
+    rate(Data("c1"), Data("d1"))
+    assert len(calls) == 1
+
+    set_version("confirmed", "c2")
+    # Derived entries embed the version in theirs, and expire with it
+    assert rate.cache.get_stats()["entries"] == 0
+    assert top.cache.get_stats()["entries"] == 0
+    assert rate.cache.get_stats()["expirations"] == 1
+
+    # Same version again: nothing expired
+    rate(Data("c2"), Data("d1"))
+    set_version("confirmed", "c2")
+    assert rate.cache.get_stats()["entries"] == 1
+
+
+def test_mapped_counts_are_not_counted(tmp_path):
+    counts = np.memmap(str(tmp_path / "counts"), dtype=np.int32, mode="w+", shape=(1000, 50))
+    df = pd.DataFrame(counts, copy=False)
+    df.insert(0, "Lat", np.zeros(1000, dtype=np.float32))
+    df.insert(0, "Country/Region", pd.Categorical(["France"] * 1000))
+
+    size = get_size(df)
+    assert 4000 <= size < counts.nbytes
+    # The same counts in private memory
+    assert get_size(df.copy()) >= size + counts.nbytes
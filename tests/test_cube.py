@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from cube import WORLDWIDE, build_cube, build_mortality_cube, get_series
+
+
+def make_cube(rows, dates=("1/22/20", "1/23/20")):
+    df = pd.DataFrame(rows, columns=["Province/State", "Country/Region", "Lat", "Long", *dates])
+    return build_cube(df)
+
+
+def test_countries_with_different_provinces():
+    # Canada reports its cases per province and its deaths for the whole
+    # country: the rate is the one of the country, not of a province
+    confirmed = make_cube([
+        ("Ontario", "Canada", 51.25, -85.32, 100, 200),
+        ("Quebec", "Canada", 52.94, -73.55, 100, 200),
+        (None, "France", 46.23, 2.21, 50, 100),
+    ])
+    deaths = make_cube([
+        (None, "Canada", 56.13, -106.35, 10, 30),
+        (None, "France", 46.23, 2.21, 5, 10),
+    ])
+    cube = build_mortality_cube(confirmed, deaths)
+    assert get_series(cube, "Canada").tolist() == [0.05, 0.075]
+    assert get_series(cube, "France").tolist() == [0.1, 0.1]
+    assert get_series(cube, WORLDWIDE).tolist() == [15 / 250, 40 / 500]
+    assert np.nanmax(cube.values) <= 1
+
+
+def test_no_case_is_nan():
+    confirmed = make_cube([
+        (None, "Afghanistan", 33.0, 65.0, 0, 1),
+        (None, "Albania", 41.15, 20.17, 0, 0),
+    ])
+    # Deaths without any confirmed case, and a country without deaths data
+    deaths = make_cube([
+        (None, "Albania", 41.15, 20.17, 1, 1),
+    ])
+    cube = build_mortality_cube(confirmed, deaths)
+    assert np.isnan(get_series(cube, "Afghanistan")[0])
+    assert get_series(cube, "Afghanistan")[1] == 0
+    assert np.isnan(get_series(cube, "Albania")).all()
+    assert not np.isinf(cube.values).any()
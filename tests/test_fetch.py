@@ -0,0 +1,62 @@
+import pytest
+import requests
+
+import fetch
+
+CONTENT = b"Province/State,Country/Region,Lat,Long,1/22/20\n,Afghanistan,33.0,65.0,0\n"
+
+
+@pytest.fixture
+def get(server, session, tmp_path):
+    server.files["/confirmed.csv"] = CONTENT
+    return lambda: fetch.fetch(server.url + "/confirmed.csv", cache_dir=str(tmp_path), session=session)
+
+
+def test_miss_downloads(get, server):
+    result = get()
+    assert result.status == "miss"
+    with open(result.path, "rb") as f:
+        assert f.read() == CONTENT
+    # Nothing on disk yet, so the request isn't conditional
+    assert "If-None-Match" not in server.requests[-1][1]
+
+
+def test_not_modified_is_a_hit(get, server):
+    first = get()
+    stats = fetch.get_fetch_stats()
+    result = get()
+    assert result == first._replace(status="hit")
+    assert server.requests[-1][1]["If-None-Match"].startswith('"')
+    assert fetch.get_fetch_stats()["hit"] == stats["hit"] + 1
+
+
+def test_modified_is_downloaded_again(get, server):
+    first = get()
+    server.files["/confirmed.csv"] = CONTENT + b",Albania,41.15,20.17,0\n"
+    result = get()
+    assert result.status == "miss"
+    assert result.path == first.path
+    assert result.digest != first.digest
+    with open(result.path, "rb") as f:
+        assert f.read() == server.files["/confirmed.csv"]
+
+
+def test_server_error_falls_back_to_the_copy_on_disk(get, server):
+    first = get()
+    server.status = 500
+    stats = fetch.get_fetch_stats()
+    result = get()
+    assert result == first._replace(status="fallback")
+    assert fetch.get_fetch_stats()["fallback"] == stats["fallback"] + 1
+
+
+def test_unreachable_server_falls_back_to_the_copy_on_disk(get, server):
+    first = get()
+    server.stop()
+    assert get() == first._replace(status="fallback")
+
+
+def test_failure_without_a_copy_raises(get, server):
+    server.status = 500
+    with pytest.raises(requests.RequestException):
+        get()
@@ -0,0 +1,100 @@
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from cube import build_cube
+
+DATES = ["1/22/20", "1/23/20", "1/24/20"]
+ROWS = [
+    ["", "Afghanistan", "33.0", "65.0", 0, 1, 2],
+    ["Hubei", "China", "30.97", "112.27", 444, 549, 761],
+    ["Beijing", "China", "40.18", "116.41", 14, 22, 36],
+    ["", "Korea, South", "36.0", "128.0", 1, 1, 2],
+]
+
+
+def make_csv(dates=DATES, rows=ROWS, newline="\n"):
+    # Quoted only where needed, like the JHU files
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator=newline)
+    writer.writerow(["Province/State", "Country/Region", "Lat", "Long"] + dates)
+    writer.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+@pytest.fixture
+def source(server, local_fetch):
+    # Publishes a version of the CSV and ingests it
+    def publish(content):
+        server.files["/confirmed.csv"] = content
+        return ingest.load_source(server.url + "/confirmed.csv")
+    return publish
+
+
+def assert_full_parse(dataset, content, tmp_path):
+    # Same data as parsing the CSV from scratch
+    path = tmp_path / "expected.csv"
+    path.write_bytes(content)
+    df = ingest.read_source_csv(str(path))
+    expected = build_cube(df)
+    assert dataset.cube.countries == expected.countries
+    assert dataset.cube.dates == expected.dates
+    np.testing.assert_array_equal(dataset.cube.values, expected.values)
+    np.testing.assert_array_equal(dataset.frame[expected.dates].to_numpy(), df[expected.dates].to_numpy())
+
+
+def test_append_date(source, tmp_path, caplog):
+    source(make_csv())
+    content = make_csv(DATES + ["1/25/20"], [row + [row[-1] + 1] for row in ROWS])
+    with caplog.at_level("INFO", logger="ingest"):
+        dataset = source(content)
+    assert "appended 1 new dates" in caplog.text
+    assert_full_parse(dataset, content, tmp_path)
+
+
+def test_revise_cell(source, tmp_path, caplog):
+    source(make_csv())
+    rows = [list(row) for row in ROWS]
+    rows[1][5] = 550
+    content = make_csv(rows=rows)
+    with caplog.at_level("INFO", logger="ingest"):
+        dataset = source(content)
+    assert "revised columns: ['1/23/20']" in caplog.text
+    assert_full_parse(dataset, content, tmp_path)
+
+
+def test_same_values_new_bytes(source, tmp_path, caplog):
+    first = source(make_csv())
+    content = make_csv(newline="\r\n")
+    dataset = source(content)
+    assert dataset.version != first.version
+    assert_full_parse(dataset, content, tmp_path)
+
+    # The snapshot was written again under the digest of the new bytes
+    with caplog.at_level("INFO", logger="ingest"):
+        again = source(content)
+    assert "using snapshot" in caplog.text
+    assert again.version == dataset.version
+
+
+def test_new_row(source, tmp_path, caplog):
+    source(make_csv())
+    content = make_csv(rows=ROWS + [["", "Zimbabwe", "-19.0", "29.0", 0, 0, 1]])
+    with caplog.at_level("INFO", logger="ingest"):
+        dataset = source(content)
+    assert "parsed the whole CSV" in caplog.text
+    assert_full_parse(dataset, content, tmp_path)
+
+
+def test_default_memory_usage(tmp_path):
+    # Same as parsing the CSV without the schema
+    path = tmp_path / "confirmed.csv"
+    path.write_bytes(make_csv())
+    default = pd.read_csv(str(path))
+    compact = ingest.read_source_csv(str(path))
+    assert ingest.get_default_memory_usage(compact) == ingest.get_memory_usage(default)
+    assert ingest.get_memory_usage(compact) < ingest.get_memory_usage(default)
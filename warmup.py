@@ -0,0 +1,68 @@
+"""Warm-up run before the app accepts traffic.
+
+Streamlit only executes app.py once a first session connects, so the
+warm-up runs as its own step of the Procfile, before the server binds its
+port and its health check passes. It downloads and ingests the sources into
+their snapshots, then builds the figures of the default World view (top 7,
+Standard scale, bubble size 7) and of the default Country view and writes
+them as pre-rendered artifacts (see prerender.py). The first session then
+memory-maps the snapshots and reads these files instead of building
+anything. The time spent in each stage is logged, to size the boot timeout.
+
+    python warmup.py
+"""
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+import app
+import prerender
+from artifacts import get_artifact_path, get_artifacts_dir, write_figure
+from ingest import CONFIRMED_SOURCE, DEATHS_SOURCE
+from monitoring import get_spans, reset_spans, span
+
+logger = logging.getLogger("warmup")
+
+
+def warm_up():
+    with span("load data"):
+        confirmed, deaths = app.load_datasets(CONFIRMED_SOURCE, DEATHS_SOURCE)
+
+    directory = get_artifacts_dir((confirmed, deaths))
+    for kind, key in prerender.get_default_tasks(confirmed, deaths):
+        fig = prerender.build_figure(kind, key, confirmed, deaths)
+        with span("write artifacts"):
+            write_figure(get_artifact_path(directory, kind, *key), fig)
+
+
+def log_stages(spans):
+    # Total time per stage, in the order the stages ended. Stages nest,
+    # "load data" includes "download" and "parse" for instance.
+    stages = OrderedDict()
+    for s in spans:
+        if s["cache"] == "hit":
+            continue
+        count, seconds = stages.get(s["stage"], (0, 0.0))
+        stages[s["stage"]] = (count + 1, seconds + s["seconds"])
+    for stage, (count, seconds) in stages.items():
+        logger.info("%-25s %4d x %9.1f ms", stage, count, 1000 * seconds)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    reset_spans()
+    start = time.perf_counter()
+    try:
+        warm_up()
+    except Exception:
+        logger.exception("warm-up failed, the first session will load the data itself")
+        sys.exit(1)
+    finally:
+        log_stages(get_spans())
+    logger.info("warm-up done in %.2f s", time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
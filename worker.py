@@ -0,0 +1,59 @@
+"""Ingest worker shared by the app processes of a host.
+
+Refreshes the JHU sources on a schedule and writes their snapshots, which
+are swapped atomically. App processes started with COVID_INGEST_WORKER=1
+only memory-map these snapshots and pick up a new version on their next
+rerun, without downloading or parsing anything themselves.
+
+    python worker.py                  # refresh every REFRESH_SECONDS
+    python worker.py --once           # refresh once and exit
+"""
+import argparse
+import logging
+import os
+import time
+
+from ingest import (
+    CONFIRMED_SOURCE, DEATHS_SOURCE, LOAD_RECOVERED, RECOVERED_SOURCE, US_CONFIRMED_SOURCE, US_DEATHS_SOURCE,
+    load_source
+)
+
+logger = logging.getLogger("worker")
+
+SOURCES = [CONFIRMED_SOURCE, DEATHS_SOURCE, US_CONFIRMED_SOURCE, US_DEATHS_SOURCE]
+if LOAD_RECOVERED:
+    SOURCES.append(RECOVERED_SOURCE)
+# JHU updates the time series once a day, checking more often only costs a
+# conditional request per source
+REFRESH_SECONDS = int(os.environ.get("COVID_REFRESH_SECONDS", "900"))
+
+
+def refresh(urls):
+    # A source that fails keeps its previous snapshot, the others are still refreshed
+    for url in urls:
+        start = time.perf_counter()
+        try:
+            dataset = load_source(url)
+        except Exception:
+            logger.exception("refresh %s failed", url)
+            continue
+        logger.info("refresh %s: version %s in %.2f s", url, dataset.version, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="refresh once and exit")
+    parser.add_argument("--interval", type=int, default=REFRESH_SECONDS, help="seconds between two refreshes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    while True:
+        refresh(SOURCES)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()